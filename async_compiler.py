@@ -0,0 +1,145 @@
+"""Compile from asyncio code, without blocking the event loop: the work is done in a pool of processes.
+
+    async with AsyncCompiler(max_workers=4) as compiler:
+        ir_code = await compiler.compile(source)
+
+        async for result in compiler.compile_many([('a.c', source_a), ('b.c', source_b)], timeout=10):
+            print(result['name'], result['error'] or 'OK')
+
+Results come back as soon as they are ready, not in the order of the jobs. A compilation that fails or times out gives a
+result with an error, the other ones go on.
+
+Each compilation gets its own `llvm_converter_state` (see `llvm_backend.fresh_state`), in its own process: nothing can
+leak from one to another. That's also why the pool has to be a pool of processes, not threads.
+
+A worker process can't be interrupted. When a job times out or is cancelled we stop waiting for it right away, but it
+keeps its worker busy until it's done: it still counts in `concurrency` until then.
+"""
+import asyncio
+import concurrent.futures
+import time
+from typing import AsyncIterator, Iterable, Tuple, Union
+
+from inliner import inline_calls, INLINE_LIMIT
+from lexer import load_grammar, parse_source, to_ast
+from llvm_backend import fresh_state, iter_llvm
+from loop_invariants import hoist_invariants
+from preprocessor import preprocess
+
+GRAMMAR_PATH = 'C_grammar'
+
+# Grammar path => grammar, loaded once per worker process.
+_grammars = {}
+
+
+def compile_source(source: str, grammar_path: str = GRAMMAR_PATH, inline_limit: int = INLINE_LIMIT, hoist: bool = True,
+                   unroll_count: int = 0) -> str:
+    """C source to IR, like `python main.py`. This is what the workers run."""
+    if grammar_path not in _grammars:
+        _grammars[grammar_path] = load_grammar(grammar_path)
+    text, source_map = preprocess(source)
+    ast = to_ast(parse_source(_grammars[grammar_path], text, source_map=source_map))
+    ast.statements = list(inline_calls(ast.statements, inline_limit))
+    if hoist:
+        ast.statements = list(hoist_invariants(ast.statements))
+    with fresh_state():
+        return ''.join(iter_llvm(ast.statements, unroll_count=unroll_count))
+
+
+def _compile_job(source: str, grammar_path: str, inline_limit: int, hoist: bool, unroll_count: int) -> dict:
+    # Our exceptions don't all survive pickling: we send the message back instead.
+    start = time.perf_counter()
+    try:
+        return {'ir': compile_source(source, grammar_path, inline_limit, hoist, unroll_count), 'error': None,
+                'compile_time': time.perf_counter() - start}
+    except Exception as e:
+        return {'ir': None, 'error': f'{e.__class__.__name__}: {e}', 'compile_time': time.perf_counter() - start}
+
+
+class CompileError(Exception):
+    pass
+
+
+class AsyncCompiler:
+
+    def __init__(self, executor: Union[concurrent.futures.ProcessPoolExecutor, None] = None,
+                 max_workers: Union[int, None] = None, concurrency: Union[int, None] = None,
+                 grammar_path: str = GRAMMAR_PATH, inline_limit: int = INLINE_LIMIT, hoist: bool = True,
+                 unroll_count: int = 0):
+        """
+        :param executor: the pool of processes to use. We make one with `max_workers` processes if there's none, and
+        shut it down in `close`.
+        :param concurrency: how many compilations at most are running or waiting in the pool. The others wait here,
+        where cancelling them costs nothing. Defaults to the number of workers.
+        """
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else concurrent.futures.ProcessPoolExecutor(max_workers)
+        # There's no public way to ask a pool how big it is.
+        self.concurrency = concurrency or max_workers or getattr(self.executor, '_max_workers', 1)
+        self.grammar_path = grammar_path
+        self.inline_limit = inline_limit
+        self.hoist = hoist
+        self.unroll_count = unroll_count
+        self._semaphore = None
+
+    async def compile(self, source: str, timeout: Union[float, None] = None) -> str:
+        """The IR of `source`. Raises CompileError if it does not compile, asyncio.TimeoutError if it takes more than
+        `timeout` seconds (not counting the wait for a worker)."""
+        result = await self._run(source, timeout)
+        if result['error'] is not None:
+            raise CompileError(result['error'])
+        return result['ir']
+
+    async def compile_many(self, jobs: Iterable[Tuple[str, str]], timeout: Union[float, None] = None) \
+            -> AsyncIterator[dict]:
+        """Compile all the (name, source) jobs, and yield their results as they finish: dicts with the name, the IR,
+        the error and the compile time. Stopping the iteration cancels the jobs that are left."""
+        tasks = [asyncio.ensure_future(self._named_result(name, source, timeout)) for name, source in jobs]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _named_result(self, name: str, source: str, timeout: Union[float, None]) -> dict:
+        try:
+            result = await self._run(source, timeout)
+        except asyncio.TimeoutError:
+            result = {'ir': None, 'error': f'TimeoutError: took more than {timeout}s', 'compile_time': timeout}
+        result['name'] = name
+        return result
+
+    async def _run(self, source: str, timeout: Union[float, None]) -> dict:
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None:
+            # Made here and not in __init__: it belongs to the loop we run in.
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        semaphore = self._semaphore
+        await semaphore.acquire()
+        try:
+            job = self.executor.submit(_compile_job, source, self.grammar_path, self.inline_limit, self.hoist,
+                                       self.unroll_count)
+        except BaseException:
+            # A broken or shut down pool: no job, no callback to free the slot.
+            semaphore.release()
+            raise
+        # Called from a thread of the pool. The slot is free when the worker is, whether we waited for it or not.
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(semaphore.release))
+        try:
+            # Shielded: a timeout or a cancel must not mark the job done while the worker is still at it.
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Only works if no worker started it yet.
+            job.cancel()
+            raise
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
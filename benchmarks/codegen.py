@@ -0,0 +1,82 @@
+"""How long generating IR takes, on generated code full of constants. Parsing is done once and not measured.
+
+    python benchmarks/codegen.py [--functions 200] [--repeat 10]
+"""
+import io
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import click
+from llvmlite import ir
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from lexer import load_grammar  # noqa: E402
+from llvm_backend import iter_llvm  # noqa: E402
+from streaming import iter_statements  # noqa: E402
+
+
+def generated_source(functions: int) -> str:
+    """Like what a code generator would write: the same few constants over and over."""
+    body = """    int a = n * 3 + 7;
+    char c = 'x';
+    a = a - (a % 5) * 2 + c - 1;
+    if (a > 100) a = a / 2 - 10;
+    if (!(a == 0)) a = a + 1;
+    int i;
+    for (i = 0; i < 10; i = i + 1) a = a * 2 + 1 - i;
+    return a + 0 * 1 + 2 * 3 - 4;"""
+    return '\n'.join(f'int f{i}(int n) {{\n{body}\n}}' for i in range(functions))
+
+
+def generate(statements):
+    return ''.join(iter_llvm(statements))
+
+
+def count_constants(statements) -> int:
+    """How many llvmlite constants generating the IR creates."""
+    created = 0
+    original_init = ir.Constant.__init__
+
+    def counting_init(self, *args, **kwargs):
+        nonlocal created
+        created += 1
+        original_init(self, *args, **kwargs)
+
+    ir.Constant.__init__ = counting_init
+    try:
+        generate(statements)
+    finally:
+        ir.Constant.__init__ = original_init
+    return created
+
+
+@click.command()
+@click.option('--functions', type=int, default=200)
+@click.option('--repeat', type=int, default=10)
+def codegen(functions, repeat):
+    grammar = load_grammar(os.path.join(REPO, 'C_grammar'))
+    statements = list(iter_statements(grammar, io.StringIO(generated_source(functions))))
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        generate(statements)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    generate(statements)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    click.echo(f'{functions} functions: median {statistics.median(timings) * 1000:.1f}ms  '
+               f'min {min(timings) * 1000:.1f}ms  peak memory {peak / 1024:.0f}KB  '
+               f'{count_constants(statements)} constants created')
+
+
+if __name__ == '__main__':
+    codegen()
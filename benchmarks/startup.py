@@ -0,0 +1,46 @@
+"""How long `main.py` takes from start to finish in each mode, on a small program: mostly startup time.
+
+    python benchmarks/startup.py [source file] [--repeat 20]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def modes(source_file):
+    return {
+        'help': ['--help'],
+        'tokens': ['--emit=tokens', source_file],
+        'ast': ['--emit=ast', source_file],
+        'run': ['--run', source_file],
+        'ir': ['--emit=ir', source_file],
+    }
+
+
+def measure(args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Exit codes are not checked: `--run` exits with whatever the program returns.
+        subprocess.run([sys.executable, 'main.py'] + args, cwd=REPO, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+@click.command()
+@click.argument('source-file', default=os.path.join('examples', 'funs', 'ex4.c'))
+@click.option('--repeat', type=int, default=20)
+def startup(source_file, repeat):
+    for mode, args in modes(source_file).items():
+        timings = measure(args, repeat)
+        click.echo(f'{mode:>8}: median {statistics.median(timings) * 1000:6.1f}ms  min {min(timings) * 1000:6.1f}ms')
+
+
+if __name__ == '__main__':
+    startup()
@@ -0,0 +1,8 @@
+int count_down(int n, int steps) {
+    if (n == 0) return steps;
+    return count_down(n - 1, steps + 1);
+}
+
+int main() {
+    return count_down(3000000, 0) - 2999958;
+}
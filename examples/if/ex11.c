@@ -0,0 +1,21 @@
+int step(int state) {
+    if (state == 0) {
+        return 3;
+    } else if (state == 1) {
+        return 2;
+    } else if (state == 2) {
+        return 4;
+    } else if (state == 3) {
+        return 1;
+    }
+    return 0;
+}
+
+int main() {
+    int state = 0;
+    int steps = 0;
+    for (state = step(0); state; state = step(state)) {
+        steps = steps + 1;
+    }
+    return steps;
+}
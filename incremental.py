@@ -0,0 +1,167 @@
+r"""Reparse a program after an edit without reparsing all of it.
+
+A program is a sequence of top-level statements (`Block => Statement \s Block | Statement` in the grammar), most of
+them functions. We remember where each of them starts in the source. After an edit we only parse again the statements
+the edit touches, the others keep their AST and just move by the length of the edit.
+
+    result = parse_incremental(g, source)
+    result = reparse(g, result, offset=120, deleted_length=3, inserted_text='42')
+    result.ast  # Same as `to_ast(parse_source(g, preprocess(new_source)[0]))`
+
+The unit of work is a top-level statement: an edit in a function body reparses that function (and nothing else).
+"""
+import bisect
+import re
+from typing import List, Union
+
+import tree
+from lexer import parse_atom, parse_source, to_ast, ParseContext, ParseError, ParseLimitExceeded, default_max_steps
+from preprocessor import preprocess, PreprocessError
+
+
+class Segment:
+    """A top-level statement and the source text it owns: from where it starts to where the next one starts.
+
+    So comments and whitespace after a statement belong to it. Segments cover the whole source, without gaps.
+    """
+
+    def __init__(self, start: int, end: int, statements: List[tree.AstNode]):
+        self.start = start
+        self.end = end
+        # Usually a single node. A chained declaration gives two, a lone `;` gives [None] (like `to_ast` does).
+        self.statements = statements
+
+    def shifted(self, delta: int) -> 'Segment':
+        return Segment(self.start + delta, self.end + delta, self.statements)
+
+
+class ParseResult:
+
+    def __init__(self, text: str, segments: List[Segment]):
+        self.text = text
+        self.segments = segments
+
+    @property
+    def ast(self) -> tree.Wrap:
+        return tree.Wrap([statement for segment in self.segments for statement in segment.statements])
+
+
+class _RegionError(Exception):
+    """The region could not be parsed on its own. Might be fine with more text."""
+    pass
+
+
+def _parse_region(grammar, text: str, start: int, end: int, stop_at: int, max_steps: Union[int, None]) \
+        -> List[Segment]:
+    """Parse top-level statements in text[start:end], stopping at the first statement that starts at or after `stop_at`.
+
+    Everything after `stop_at` is only there so the parser sees the same text it would see in a full parse.
+    """
+    original_region = text[start:end]
+    try:
+        region, source_map = preprocess(original_region)
+    except PreprocessError:
+        raise _RegionError()
+    context = ParseContext(grammar, max_steps=default_max_steps(region) if max_steps is None else max_steps or None)
+
+    segments = []
+    position = 0
+    statement_start = start
+    while True:
+        try:
+            tokens, remainder = parse_atom(grammar, 'Statement', region[position:], context=context)
+        except (ParseError, ParseLimitExceeded):
+            raise _RegionError()
+        # Top-level statements need whitespace in between, see the grammar.
+        separator = re.match(r'\s+', remainder)
+        position = len(region) - len(remainder) + (separator.end() if separator is not None else 0)
+
+        at_end = position == len(region)
+        if not at_end and separator is None:
+            raise _RegionError()
+
+        # Checked before: what is followed by neither whitespace nor the end might not make a sensible ast.
+        statements = to_ast(tokens)
+        statements = statements if isinstance(statements, list) else [statements]
+
+        if at_end:
+            segments.append(Segment(statement_start, end, statements))
+            return segments
+
+        next_start = start + source_map.original_offset(position)
+        segments.append(Segment(statement_start, next_start, statements))
+        if next_start >= stop_at:
+            return segments
+        statement_start = next_start
+
+
+def parse_incremental(grammar, text: str, max_steps: Union[int, None] = None) -> ParseResult:
+    """Parse a whole program, keeping what we need to reparse it quickly later.
+
+    Raises a SourceSyntaxError like `lexer.parse_source` if the program is invalid.
+    """
+    if not text:
+        return ParseResult(text, [])
+    try:
+        segments = _parse_region(grammar, text, 0, len(text), len(text), max_steps)
+    except _RegionError:
+        _raise_syntax_error(grammar, text, max_steps)
+    return ParseResult(text, segments)
+
+
+def _raise_syntax_error(grammar, text, max_steps):
+    # Only on invalid programs: we parse again the usual way, for the usual error message.
+    source, source_map = preprocess(text)
+    parse_source(grammar, source, max_steps=max_steps, source_map=source_map)
+    # Should not happen: it means the two parsing methods disagree.
+    raise ParseError('Incremental parsing failed but the full parse did not')
+
+
+def reparse(grammar, previous: ParseResult, offset: int, deleted_length: int, inserted_text: str,
+            max_steps: Union[int, None] = None) -> ParseResult:
+    """Apply an edit to the source of `previous` and return the new parse result.
+
+    :param offset: where the edit starts in the previous text.
+    :param deleted_length: how many characters of the previous text the edit removes, from `offset`.
+    :param inserted_text: what the edit puts in their place.
+    """
+    old_text = previous.text
+    text = old_text[:offset] + inserted_text + old_text[offset + deleted_length:]
+    segments = previous.segments
+    if not segments or not text:
+        return parse_incremental(grammar, text, max_steps=max_steps)
+
+    delta = len(inserted_text) - deleted_length
+    starts = [segment.start for segment in segments]
+    # The segments the edit touches. Touching the very beginning of a segment counts for the previous one too: the
+    # edit might remove the whitespace that separates them.
+    first = max(bisect.bisect_right(starts, offset) - 1, 0)
+    if segments[first].start == offset and first > 0:
+        first -= 1
+    last = bisect.bisect_right(starts, offset + deleted_length) - 1
+
+    region_start = segments[first].start
+    while True:
+        # Where the untouched segments start again, in the new text.
+        region_end = segments[last].end + delta
+        if last + 1 < len(segments):
+            # We give the parser the next segment too. It should not need it, but `a` followed by `(1);` is a
+            # function call and we would not know without looking.
+            lookahead_end, stop_at = segments[last + 1].end + delta, region_end
+        else:
+            lookahead_end = stop_at = len(text)
+        try:
+            new_segments = _parse_region(grammar, text, region_start, lookahead_end, stop_at, max_steps)
+        except _RegionError:
+            new_segments = None
+
+        if new_segments is not None and new_segments[-1].end == region_end:
+            break
+        if last + 1 >= len(segments):
+            # Nothing left to extend the region with. The source is invalid.
+            _raise_syntax_error(grammar, text, max_steps)
+        # A statement spilled over the next segment, or needs more text. Take the next segment in and try again.
+        last += 1
+
+    following = [segment.shifted(delta) for segment in segments[last + 1:]]
+    return ParseResult(text, segments[:first] + new_segments + following)
@@ -0,0 +1,134 @@
+"""Incremental builds: only generate IR again for the functions that changed.
+
+For each function we compute a fingerprint from its ast and from the signatures of the functions it calls (the IR of a
+call depends on them). If the fingerprint is the one we saved last time, we reuse the IR we saved with it.
+
+The cache is a json file: {function name: {'fingerprint': ..., 'ir': ..., 'metadata': [...]}}.
+
+Metadata (what we tell LLVM about loops) is numbered for the whole module: `!0`, `!1`... We keep the IR and the metadata
+of a function numbered from `!0`, and renumber them when we put the module together.
+"""
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Tuple
+
+import llvm_backend
+from llvm_backend import function_to_llvm, declare_function, declare_globals, module_header, new_module, iter_llvm
+from tree import AstNode, Function, FunctionCall, Wrap
+
+
+def _backend_version() -> str:
+    # Any change in the code generator can change the IR of every function.
+    with open(llvm_backend.__file__, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _structure(node) -> list:
+    """Everything about a node that can change the code we generate: its class, its values and its children."""
+    if isinstance(node, AstNode):
+        return [node.__class__.__name__] + [[key, _structure(value)] for key, value in sorted(vars(node).items())]
+    if isinstance(node, (list, tuple)):
+        return [_structure(item) for item in node]
+    return node
+
+
+def function_signature(node: Function) -> str:
+    return f'{node.return_type} {node.name.name}({", ".join(arg.type for arg in node.args.args)})'
+
+
+def function_fingerprints(ast: Wrap, unroll_count: int = 0) -> Dict[str, str]:
+    functions = {node.name.name: node for node in ast.statements if isinstance(node, Function)}
+    # Settings of the backend are part of its version.
+    backend_version = [_backend_version(), unroll_count]
+
+    fingerprints = {}
+    for name, node in functions.items():
+        called = sorted({n.function_id.name for n in node.walk() if isinstance(n, FunctionCall)})
+        callees = [function_signature(functions[c]) if c in functions else c for c in called]
+        content = json.dumps([backend_version, _structure(node), callees])
+        fingerprints[name] = hashlib.sha1(content.encode()).hexdigest()
+    return fingerprints
+
+
+def renumber_metadata(text: str, offset: int) -> str:
+    """Add `offset` to the numbers of the metadata in IR. Only metadata starts with `!`: names of variables and
+    functions can't have one, and strings are not in functions."""
+    return re.sub(r'!(\d+)', lambda match: f'!{int(match.group(1)) + offset}', text)
+
+
+def cache_path(cache_dir: str, source_path: str) -> str:
+    """One cache file per source file."""
+    key = hashlib.sha1(os.path.abspath(source_path).encode()).hexdigest()
+    return os.path.join(cache_dir, f'{key}.json')
+
+
+def load_cache(path: str) -> Dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # No cache yet, or a broken one. Either way we start over.
+        return {}
+
+
+def save_cache(path: str, cache: Dict):
+    # Write then rename, so an interrupted build does not leave half a cache behind.
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(temporary_path, path)
+
+
+def compile_incremental(ast: Wrap, cache: Dict, unroll_count: int = 0) -> Tuple[str, List[str]]:
+    """Return the IR for the program and the names of the functions we actually compiled.
+
+    `cache` is updated in place, to be saved for the next build.
+
+    :param unroll_count: see `llvm_backend.loop_metadata`.
+    """
+    statements = [node for node in ast.statements if node is not None]
+    names = [node.name.name for node in statements if isinstance(node, Function)]
+    if len(names) != len(statements) or len(set(names)) != len(names):
+        # Top-level code that is not a function, or the same name twice: no incremental build for weird programs.
+        cache.clear()
+        # Not `to_llvm`, that knows nothing of the unroll count. The last piece is the newline at the end.
+        return ''.join(list(iter_llvm(statements, unroll_count=unroll_count))[:-1]), names
+
+    fingerprints = function_fingerprints(ast, unroll_count)
+    module = new_module()
+    llvm_backend.llvm_converter_state.unroll_count = unroll_count
+    compiled = []
+    for node in statements:
+        name = node.name.name
+        entry = cache.get(name)
+        if entry is not None and entry['fingerprint'] == fingerprints[name]:
+            # Later functions might call this one: they need to know it exists.
+            declare_function(node, module)
+            # And the strings it uses must be in the module, once, whoever else uses them.
+            declare_globals(node, module)
+        else:
+            first_metadata = len(module.metadata)
+            function_to_llvm(node, module)
+            cache[name] = {'fingerprint': fingerprints[name],
+                           'ir': renumber_metadata(str(module.get_global(name)), -first_metadata),
+                           'metadata': [renumber_metadata(str(metadata), -first_metadata)
+                                        for metadata in module.metadata[first_metadata:]]}
+            compiled.append(name)
+
+    for name in set(cache) - set(names):
+        del cache[name]
+
+    # Same layout as `str(module)` for a module with all functions defined.
+    pieces = [module_header(module)]
+    metadata = []
+    for global_value in module.globals.values():
+        if global_value.name in cache:
+            entry = cache[global_value.name]
+            offset = len(metadata)
+            pieces.append('\n' + renumber_metadata(entry['ir'], offset))
+            metadata.extend(renumber_metadata(line, offset) for line in entry['metadata'])
+        else:
+            pieces.append('\n' + str(global_value))
+    return ''.join(pieces) + ''.join('\n' + line for line in metadata), compiled
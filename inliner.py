@@ -0,0 +1,185 @@
+"""Inline calls to small functions, on the ast, before generating IR.
+
+What we inline: functions that return an int, call nothing (so they are not recursive either) and are just a few
+declarations and assignments followed by a `return`, at most `limit` nodes in all. Like:
+
+    int square(int x) { return x * x; }
+
+`y = square(a + 1);` becomes `int __inline_square_0_x = a + 1; y = __inline_square_0_x * __inline_square_0_x;`. The
+variables of the function are renamed so that they don't clash with the ones of the caller: there's only one scope per
+function in the backend. When an argument is a constant or a variable of the right type, and the function does not
+assign to it, we use it as is instead.
+
+The declarations go right before the statement with the call. They don't call anything so running them a bit earlier
+changes nothing. Where we can't put statements (the condition and the increment of a `for`, that run many times), we
+only inline when no declaration is needed.
+"""
+import copy
+import itertools
+from typing import Dict, Iterable, Iterator, List, Union
+
+from tree import AstNode, Assignment, BodyBlock, Char, Declaration, ForLoop, Function, FunctionCall, Identifier, If, \
+    Integer, Return
+from type_inference import function_types, rewrite_types, TypeInferenceError, INT, STRING
+
+# Nodes in the body of a function. `return x * x;` is 5 of them.
+INLINE_LIMIT = 20
+
+
+def inline_calls(statements: Iterable[AstNode], limit: int = INLINE_LIMIT) -> Iterator[AstNode]:
+    """The statements, with calls inlined. Functions can only be inlined in the ones that come after them.
+
+    The statements are changed in place. Works just as well on a generator, see `streaming`.
+    """
+    inlinable = {}
+    return_types = {}
+    for statement in statements:
+        if isinstance(statement, Function) and limit > 0:
+            return_types[statement.name.name] = statement.return_type
+            types = rewrite_types(statement, return_types)
+            if types is not None:
+                # Numbered in the function only: the names (and the IR) don't change when other functions do.
+                inline_in_block(statement.body, types, inlinable, itertools.count())
+            if is_inlinable(statement, limit):
+                inlinable[statement.name.name] = statement
+        yield statement
+
+
+def is_inlinable(node: Function, limit: int) -> bool:
+    *statements, last = node.body.statements or [None]
+    if node.return_type != INT or not isinstance(last, Return):
+        return False
+    if not all(isinstance(statement, (Declaration, Assignment)) for statement in statements):
+        return False
+    nodes = list(node.body.walk())
+    if len(nodes) > limit or any(isinstance(child, (FunctionCall, Return)) for child in nodes if child is not last):
+        return False
+    try:
+        types = function_types(node, {})
+    except TypeInferenceError:
+        return False
+    return types[id(last.value)] != STRING
+
+
+def inline_in_block(block: BodyBlock, types: Dict[int, str], inlinable: Dict[str, Function], counter: Iterator[int]):
+    statements = []
+    for statement in block.statements:
+        # What the inlined functions need, to run before the statement.
+        before = []
+        if isinstance(statement, If):
+            statement.condition = inline_in_expression(statement.condition, types, inlinable, counter, before)
+            inline_in_block(statement.if_block, types, inlinable, counter)
+            if statement.else_block is not None:
+                inline_in_block(statement.else_block, types, inlinable, counter)
+        elif isinstance(statement, ForLoop):
+            if statement.for_init is not None:
+                statement.for_init = inline_in_statement(statement.for_init, types, inlinable, counter, before)
+            # These run again and again: nothing can go before them.
+            statement.for_condition = inline_in_expression(statement.for_condition, types, inlinable, counter, None)
+            statement.for_increment = inline_in_expression(statement.for_increment, types, inlinable, counter, None)
+            inline_in_block(statement.for_body, types, inlinable, counter)
+        elif isinstance(statement, BodyBlock):
+            inline_in_block(statement, types, inlinable, counter)
+        else:
+            statement = inline_in_statement(statement, types, inlinable, counter, before)
+        statements.extend(before)
+        statements.append(statement)
+    block.statements = statements
+
+
+def inline_in_statement(statement: AstNode, types: Dict[int, str], inlinable: Dict[str, Function],
+                        counter: Iterator[int], before: List[AstNode]) -> AstNode:
+    """Declarations, assignments, returns and expressions alone."""
+    if isinstance(statement, (Declaration, Return)):
+        if statement.value is not None:
+            statement.value = inline_in_expression(statement.value, types, inlinable, counter, before)
+        return statement
+    if isinstance(statement, Assignment):
+        # `a = f(a);` is fine: `a` only changes once the value is known.
+        statement.value = inline_in_expression(statement.value, types, inlinable, counter, before)
+        return statement
+    return inline_in_expression(statement, types, inlinable, counter, before)
+
+
+def inline_in_expression(node: Union[AstNode, None], types: Dict[int, str], inlinable: Dict[str, Function],
+                         counter: Iterator[int], before: Union[List[AstNode], None]) -> Union[AstNode, None]:
+    """The expression, with calls inlined.
+
+    :param before: where to put the statements the inlined functions need. None if we can't have any.
+    """
+    if node is None:
+        return None
+    if before is not None and any(isinstance(child, Assignment) for child in node.walk()):
+        # In `b = (a = 3) + f(a)`, running the declaration of f's arg before the statement would see the old `a`.
+        before = None
+    return inline_in_node(node, types, inlinable, counter, before)
+
+
+def inline_in_node(node: AstNode, types: Dict[int, str], inlinable: Dict[str, Function], counter: Iterator[int],
+                   before: Union[List[AstNode], None]) -> AstNode:
+    # Inner calls first: `f(f(x))`.
+    map_children(node, lambda child: inline_in_node(child, types, inlinable, counter, before))
+    if isinstance(node, FunctionCall) and node.function_id.name in inlinable:
+        inlined = inline_call(node, inlinable[node.function_id.name], types, next(counter))
+        if inlined is not None:
+            statements, value = inlined
+            if not statements:
+                return value
+            if before is not None:
+                before.extend(statements)
+                return value
+    return node
+
+
+def inline_call(call: FunctionCall, function: Function, types: Dict[int, str], index: int):
+    """(statements to run first, expression to use instead of the call). None if the call cannot be inlined: one of its
+    arguments calls a function, we can't run it earlier."""
+    *body, last = function.body.statements
+    # Also declared: `int x = x + 1;` in the body is a new `x` after that.
+    assigned = {child.identifier.name for child in function.body.walk() if isinstance(child, (Assignment, Declaration))}
+    names = {}
+    values = {}
+    statements = []
+    args = call.args.args if call.args is not None else ()
+    for param, arg in zip(function.args.args, args):
+        name = param.identifier.name
+        if name not in assigned and can_substitute(arg, param.type, types):
+            values[name] = arg
+            continue
+        if any(isinstance(child, FunctionCall) for child in arg.walk()):
+            return None
+        names[name] = f'__inline_{function.name.name}_{index}_{name}'
+        statements.append(Declaration(param.type, Identifier(names[name]), arg))
+    for statement in body:
+        if isinstance(statement, Declaration):
+            names[statement.identifier.name] = f'__inline_{function.name.name}_{index}_{statement.identifier.name}'
+        statements.append(substitute(statement, names, values))
+    return statements, substitute(last.value, names, values)
+
+
+def can_substitute(arg: AstNode, param_type: str, types: Dict[int, str]) -> bool:
+    """Can we use the argument itself everywhere the function uses the parameter?"""
+    if isinstance(arg, (Integer, Char)):
+        # A constant is an int, it would need a conversion otherwise.
+        return param_type == INT
+    return isinstance(arg, Identifier) and types.get(id(arg)) == param_type
+
+
+def substitute(node: AstNode, names: Dict[str, str], values: Dict[str, AstNode]) -> AstNode:
+    """A copy of `node`, with variables renamed (`names`) or replaced by an expression (`values`)."""
+    if isinstance(node, Identifier):
+        if node.name in values:
+            return copy.deepcopy(values[node.name])
+        return Identifier(names.get(node.name, node.name))
+    node = copy.copy(node)
+    map_children(node, lambda child: substitute(child, names, values))
+    return node
+
+
+def map_children(node: AstNode, transform):
+    """Replace each child of `node` by `transform(child)`."""
+    for key, value in vars(node).items():
+        if isinstance(value, AstNode):
+            setattr(node, key, transform(value))
+        elif isinstance(value, (list, tuple)):
+            setattr(node, key, type(value)(transform(item) if isinstance(item, AstNode) else item for item in value))
@@ -0,0 +1,247 @@
+"""Run a program without LLVM.
+
+The ast is compiled once into nested Python closures: each node becomes a function taking the current frame (a list of
+variable values). Variables are resolved to a slot in the frame at compile time, so running the program does not look
+anything up by name.
+
+This is meant for quick checks and tests: no llvmlite import and no `lli` process. Arithmetic follows C (32 bits
+`int`, 8 bits `char`, division truncating towards zero).
+"""
+from typing import Callable, Dict, List, Union
+
+from tree import Function, Return, Integer, AstNode, BodyBlock, FunctionCall, Declaration, Assignment, Char, BinOp, \
+    UnOp, Wrap, String, Identifier, If, ForLoop
+
+type_to_bits = {'int': 32, 'char': 8}
+
+
+class InterpreterError(Exception):
+    pass
+
+
+def wrap_integer(value: int, bits: int = 32) -> int:
+    """What's left of `value` in a signed integer of `bits` bits (two's complement, like all machines we care about)."""
+    half = 1 << (bits - 1)
+    return ((value + half) & ((1 << bits) - 1)) - half
+
+
+def divide(left: int, right: int) -> int:
+    # Python's // rounds towards minus infinity, C truncates towards zero.
+    if right == 0:
+        raise InterpreterError('Division by zero')
+    quotient = abs(left) // abs(right)
+    return wrap_integer(-quotient if (left < 0) != (right < 0) else quotient)
+
+
+def modulo(left: int, right: int) -> int:
+    # Defined so that (a / b) * b + a % b == a, like in C.
+    return wrap_integer(left - divide(left, right) * right)
+
+
+operation_to_function = {
+    BinOp.ADD: lambda a, b: wrap_integer(a + b),
+    BinOp.SUBSTRACT: lambda a, b: wrap_integer(a - b),
+    BinOp.MULTIPLY: lambda a, b: wrap_integer(a * b),
+    BinOp.DIVIDE: divide,
+    BinOp.MODULO: modulo,
+    BinOp.GT: lambda a, b: int(a > b),
+    BinOp.LT: lambda a, b: int(a < b),
+    BinOp.GTE: lambda a, b: int(a >= b),
+    BinOp.LTE: lambda a, b: int(a <= b),
+    BinOp.EQ: lambda a, b: int(a == b),
+    BinOp.NEQ: lambda a, b: int(a != b),
+}
+
+unary_operation_to_function = {
+    UnOp.MINUS: lambda a: wrap_integer(-a),
+    UnOp.PLUS: lambda a: a,
+    UnOp.COMPLEMENT: lambda a: ~a,
+    UnOp.NOT: lambda a: int(a == 0),
+}
+
+
+class CompiledFunction:
+
+    def __init__(self, node: Function):
+        self.name = node.name.name
+        self.return_bits = type_to_bits[node.return_type]
+        self.arg_bits = [type_to_bits[arg.type] for arg in node.args.args]
+        # Filled by `compile_function`: we need all the CompiledFunction objects to exist before to compile calls.
+        self.body = None
+        self.frame_size = 0
+
+    def __call__(self, *args: int) -> int:
+        if len(args) != len(self.arg_bits):
+            raise InterpreterError(f'{self.name} takes {len(self.arg_bits)} arguments, got {len(args)}')
+        frame = [0] * self.frame_size
+        frame[:len(args)] = [wrap_integer(value, bits) for value, bits in zip(args, self.arg_bits)]
+        result = self.body(frame)
+        # Falling off the end of a function: 0, like `main` does in C.
+        return 0 if result is None else wrap_integer(result, self.return_bits)
+
+
+class Scope:
+    """Variables of the function being compiled: name => slot in the frame. Like the LLVM backend, one per function."""
+
+    def __init__(self, functions: Dict[str, CompiledFunction]):
+        self.functions = functions
+        self.slots = {}
+        self.bits = []
+
+    def declare(self, name: str, var_type: str) -> int:
+        self.slots[name] = len(self.bits)
+        self.bits.append(type_to_bits[var_type])
+        return self.slots[name]
+
+    def lookup(self, name: str) -> int:
+        try:
+            return self.slots[name]
+        except KeyError:
+            raise InterpreterError(f'Unknown variable {name}') from None
+
+
+def compile_function(node: Function, functions: Dict[str, CompiledFunction]):
+    compiled = functions[node.name.name]
+    scope = Scope(functions)
+    # Arguments come first in the frame, that's where `CompiledFunction.__call__` puts them.
+    for arg in node.args.args:
+        scope.declare(arg.identifier.name, arg.type)
+    compiled.body = compile_node(node.body, scope)
+    compiled.frame_size = len(scope.bits)
+
+
+def compile_program(ast: Wrap) -> Dict[str, CompiledFunction]:
+    functions = {}
+    for statement in ast.statements:
+        if statement is None:
+            continue
+        if not isinstance(statement, Function):
+            raise InterpreterError(f'Only functions are supported at the top level, got {statement}')
+        functions[statement.name.name] = CompiledFunction(statement)
+    for statement in ast.statements:
+        if statement is not None:
+            compile_function(statement, functions)
+    return functions
+
+
+def run(ast: Wrap, function: str = 'main') -> int:
+    """Run the program and return what `main` returns."""
+    functions = compile_program(ast)
+    main = functions[function]
+    # `lli` calls main(argc, argv) with just the program name: argc is 1.
+    args = [1] + [0] * (len(main.arg_bits) - 1) if main.arg_bits else []
+    try:
+        return main(*args)
+    except RecursionError:
+        # Each C call is a few Python calls deep. `lli` has a much bigger stack, and turns self tail calls into loops.
+        raise InterpreterError('Recursion too deep for the interpreter, compile the program instead') from None
+
+
+def compile_node(node: AstNode, scope: Scope) -> Callable[[List[int]], Union[int, None]]:
+    """Return a closure running `node` on a frame.
+
+    For expressions the closure returns the value. For statements it returns None, unless a `return` was hit: then it
+    returns the value returned by the function (it's never None, so we know when to stop).
+    """
+    if isinstance(node, BodyBlock):
+        statements = [compile_statement(statement, scope) for statement in node.statements if statement is not None]
+
+        def run_block(frame):
+            for statement in statements:
+                result = statement(frame)
+                if result is not None:
+                    return result
+        return run_block
+
+    if isinstance(node, Return):
+        value = compile_node(node.value, scope)
+        return value
+
+    if isinstance(node, Declaration):
+        value = compile_node(node.value, scope) if node.value is not None else None
+        slot = scope.declare(node.identifier.name, node.type)
+        bits = scope.bits[slot]
+
+        def declare(frame):
+            # Uninitialized variables are 0. It's as good a value as any.
+            frame[slot] = wrap_integer(value(frame), bits) if value is not None else 0
+        return declare
+
+    if isinstance(node, Assignment):
+        value = compile_node(node.value, scope)
+        slot = scope.lookup(node.identifier.name)
+        bits = scope.bits[slot]
+
+        def assign(frame):
+            frame[slot] = wrap_integer(value(frame), bits)
+            return frame[slot]
+        return assign
+
+    if isinstance(node, Identifier):
+        slot = scope.lookup(node.name)
+        return lambda frame: frame[slot]
+
+    if isinstance(node, (Integer, Char)):
+        constant = wrap_integer(node.value) if isinstance(node, Integer) else ord(node.value)
+        return lambda frame: constant
+
+    if isinstance(node, BinOp):
+        left = compile_node(node.left, scope)
+        right = compile_node(node.right, scope)
+        operation = operation_to_function[node.operation]
+        return lambda frame: operation(left(frame), right(frame))
+
+    if isinstance(node, UnOp):
+        operand = compile_node(node.operand, scope)
+        operation = unary_operation_to_function[node.operation]
+        return lambda frame: operation(operand(frame))
+
+    if isinstance(node, FunctionCall):
+        try:
+            function = scope.functions[node.function_id.name]
+        except KeyError:
+            raise InterpreterError(f'Unknown function {node.function_id.name}') from None
+        args = [compile_node(arg, scope) for arg in node.args.args] if node.args else []
+        return lambda frame: function(*[arg(frame) for arg in args])
+
+    if isinstance(node, If):
+        condition = compile_node(node.condition, scope)
+        if_block = compile_node(node.if_block, scope)
+        else_block = compile_node(node.else_block, scope) if node.else_block is not None else lambda frame: None
+
+        def run_if(frame):
+            if condition(frame):
+                return if_block(frame)
+            return else_block(frame)
+        return run_if
+
+    if isinstance(node, ForLoop):
+        init = compile_node(node.for_init, scope)
+        condition = compile_node(node.for_condition, scope)
+        increment = compile_node(node.for_increment, scope)
+        body = compile_node(node.for_body, scope)
+
+        def run_for(frame):
+            init(frame)
+            while condition(frame):
+                result = body(frame)
+                if result is not None:
+                    return result
+                increment(frame)
+        return run_for
+
+    if isinstance(node, String):
+        raise InterpreterError('Strings are not supported by the interpreter')
+
+    raise InterpreterError(f'Cannot interpret {node}')
+
+
+def compile_statement(node: AstNode, scope: Scope):
+    compiled = compile_node(node, scope)
+    if isinstance(node, (Return, Declaration, If, ForLoop, BodyBlock)):
+        return compiled
+
+    # An expression used as a statement (`a = 1;`). Its value must not be taken for a return value.
+    def discard_value(frame):
+        compiled(frame)
+    return discard_value
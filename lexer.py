@@ -1,7 +1,10 @@
+import marshal
+import os
 import re
-from typing import List, Dict, Tuple, Union
+from typing import Iterator, List, Dict, Tuple, Union
 
 import tree as tree
+from preprocessor import SourceMap
 
 # Variables tied to the grammar definition.
 REPEAT_START = 'REPEAT_START'
@@ -25,11 +28,135 @@ def read_grammar(description):
     return g
 
 
+def load_grammar(path: str) -> Dict[str, Tuple[List[str]]]:
+    """`read_grammar` on a file, with the result cached in `__pycache__` next to it (like Python does for modules).
+
+    The cache is used as long as the grammar file does not change.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    # marshal and not pickle: it's built in, so there's nothing to import, and it handles all we need.
+    cache_path = os.path.join(os.path.dirname(path), '__pycache__', os.path.basename(path) + '.marshal')
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_key, grammar = marshal.load(f)
+        if cached_key == key:
+            return grammar
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    with open(path, 'r') as f:
+        grammar = read_grammar(f.read())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            marshal.dump((key, grammar), f)
+    except OSError:
+        # Read-only directory or something: no cache, no big deal.
+        pass
+    return grammar
+
+
 class ParseError(Exception):
     pass
 
 
-def parse_sequence(grammar, seq: List, text: str, repeat=False) -> Tuple[List, str]:
+class ParseLimitExceeded(Exception):
+    """Raised when the parser has been backtracking for too long.
+
+    This is NOT a ParseError on purpose: the parser catches ParseErrors to try the next alternative, this one has to go
+    all the way up.
+    """
+    pass
+
+
+class SourceSyntaxError(Exception):
+    """What we show the user when their program does not parse."""
+
+    def __init__(self, line: int, column: int, expected: List[str], reason: str = 'invalid syntax'):
+        self.line = line
+        self.column = column
+        self.expected = expected
+        self.reason = reason
+        super().__init__(str(self))
+
+    def __str__(self):
+        message = f'line {self.line}, column {self.column}: {self.reason}'
+        if self.expected:
+            message += f', expected {" or ".join(self.expected)}'
+        return message
+
+
+# The number of steps grows with the size of the source, so does the default budget. Valid programs use less than 30
+# steps per character, pathological backtracking quickly goes way beyond that.
+DEFAULT_STEPS_PER_CHARACTER = 200
+MIN_DEFAULT_STEPS = 100000
+
+
+class ParseContext:
+    """Book-keeping for a single parse: how far we got, what we expected there, and how hard we tried.
+
+    Positions are stored as 'how much text is left', because that's what the parser deals with (it slices the text as
+    it goes). The smaller, the further into the source.
+    """
+
+    def __init__(self, grammar, max_steps: Union[int, None] = None):
+        self.max_steps = max_steps
+        self.steps = 0
+        self.furthest_remaining = None
+        self.expected = []
+        # The closest to the end of the text the parser looked, successfully or not. If it never got near the end, more
+        # text after it could not have changed the result (see `streaming`).
+        self.nearest_end = None
+        # Rules like Identifier or Integer: we'd rather say 'expected Identifier' than show its regex.
+        self.lexical_rules = {atom for atom, alternatives in grammar.items()
+                              if all(a not in grammar for alternative in alternatives for a in alternative)}
+
+    def step(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise ParseLimitExceeded(f'Gave up after {self.max_steps} parsing steps')
+
+    def syntax_error(self, text: str, reason: str, remaining: int, source_map: SourceMap) -> SourceSyntaxError:
+        """Build the error for a parse of `text` that went wrong `remaining` characters before its end.
+
+        If the parser got further than this at some point, that's the position we report.
+        """
+        if self.furthest_remaining is not None and self.furthest_remaining <= remaining:
+            remaining, expected = self.furthest_remaining, self.expected
+        else:
+            expected = []
+        line, column = source_map.line_col(len(text) - remaining)
+        return SourceSyntaxError(line, column, expected, reason=reason)
+
+    def reached(self, remaining: int):
+        if self.nearest_end is None or remaining < self.nearest_end:
+            self.nearest_end = remaining
+
+    def fail(self, text: str, expected: str):
+        # We want the position of the token that did not match, not of the whitespace before it.
+        remaining = len(text) - re.match(r'\s*', text).end()
+        self.reached(remaining)
+        if self.furthest_remaining is None or remaining < self.furthest_remaining:
+            self.furthest_remaining = remaining
+            self.expected = []
+        if remaining == self.furthest_remaining and expected not in self.expected:
+            self.expected.append(expected)
+
+
+def default_max_steps(text: str) -> int:
+    return max(MIN_DEFAULT_STEPS, DEFAULT_STEPS_PER_CHARACTER * len(text))
+
+
+def describe_atom(atom: str) -> str:
+    """A human-readable version of a terminal atom: `\\(` is shown as `'('`."""
+    if atom == '\\s':
+        return 'whitespace'
+    return "'" + re.sub(r'\\(.)', r'\1', atom) + "'"
+
+
+def parse_sequence(grammar, seq: List, text: str, repeat=False, context: Union[ParseContext, None] = None) \
+        -> Tuple[List, str]:
     """We use this to parse things like 'var Identifier = Expr' which is effectively a sequence.
     Note the sequence could have a single element, it's not a big deal and makes it more generic.
     """
@@ -40,7 +167,7 @@ def parse_sequence(grammar, seq: List, text: str, repeat=False) -> Tuple[List, s
         # Parse the sequence as many times as we can
         while True:
             try:
-                tree_list, remainder = parse_sequence(grammar, seq, remainder, repeat=False)
+                tree_list, remainder = parse_sequence(grammar, seq, remainder, repeat=False, context=context)
             except ParseError:
                 break
 
@@ -53,26 +180,28 @@ def parse_sequence(grammar, seq: List, text: str, repeat=False) -> Tuple[List, s
         if atom == REPEAT_START:
             # Get just the sequence to repeat
             repeat_sequence = seq[(i + 1): seq.index(REPEAT_END, i)]
-            repeat_result, remainder = parse_sequence(grammar, repeat_sequence, remainder, repeat=True)
+            repeat_result, remainder = parse_sequence(grammar, repeat_sequence, remainder, repeat=True,
+                                                      context=context)
             result.extend(repeat_result)
             i = seq.index(REPEAT_END, i) + 1
         else:
-            tree, remainder = parse_atom(grammar, atom, remainder)
+            tree, remainder = parse_atom(grammar, atom, remainder, context=context)
             result.append(tree)
             i += 1
 
     return result, remainder
 
 
-def parse_atom(grammar, atom, text):
+def parse_atom(grammar, atom, text, context: Union[ParseContext, None] = None):
     """
     :param: atom: smt like Assignment. Or a terminal expression, like a regex '[0-9]'
+    :param: context: optional, to keep track of where parsing failed and to give up when it takes too long.
     """
     whitespace = '\s*'
-    # Allow line (and inline!) comments in the source code
-    if re.match(f'{whitespace}{grammar["Comment"][0][0]}', text) is not None:
-        # We strip the text before looking up the line break in case text currently starts with a line break.
-        return parse_atom(grammar, atom, text.strip()[text.strip().index('\n'):])
+    # Comments are gone by now, see `preprocessor.preprocess`.
+
+    if context is not None:
+        context.step()
 
     # We hit a terminal expression - no need to recurse further
     if atom not in grammar:
@@ -81,19 +210,29 @@ def parse_atom(grammar, atom, text):
         if match is not None:
             # match.group(0) would be with the whitespaces
             # print(atom, '--', text, '--', match.group(1))
+            if context is not None:
+                context.reached(len(text) - match.end())
             return match.group(1), text[match.end():]
         else:
+            if context is not None:
+                context.fail(text, describe_atom(atom))
             raise ParseError()
     else:
+        # Lexical rules report failures themselves, under their own name.
+        inner_context = context if context is None or atom not in context.lexical_rules else None
         # onto non-terminal atoms
         for alternative in grammar[atom]:
             try:
-                tree, remainder = parse_sequence(grammar, alternative, text)
+                tree, remainder = parse_sequence(grammar, alternative, text, context=inner_context)
             except ParseError:
                 continue
 
             # print(atom, '--', text, '--', tree)
+            if inner_context is None and context is not None:
+                context.reached(len(remainder))
             return [atom] + tree, remainder
+        if inner_context is None and context is not None:
+            context.fail(text, atom)
         # no more alternatives, fail
         raise ParseError(f'No more alternatives, cannot parse {text}')
 
@@ -112,6 +251,66 @@ def parse(grammar: Dict[str, Tuple[List[str]]], text: str):
     return parse_atom(grammar, 'Wrap', text)
 
 
+def iter_token_tree(token_list, depth=0) -> Iterator[Tuple[int, Union[list, str]]]:
+    """(depth, token) for the parse tree and everything below it, depth first: rules are lists (the name of the rule,
+    then what it matched), the rest are strings.
+
+    No recursion: statements are nested in one another, a big program makes a very deep tree.
+    """
+    stack = [(depth, token_list)]
+    while stack:
+        depth, token = stack.pop()
+        yield depth, token
+        if isinstance(token, list):
+            stack.extend((depth + 1, child) for child in reversed(token[1:]))
+
+
+def iter_token_lines(token_list, depth=0) -> Iterator[str]:
+    """The parse tree, one line per token, indented like `tree.iter_ast_lines`."""
+    indent = ' ' * 2
+    for token_depth, token in iter_token_tree(token_list, depth):
+        yield indent * token_depth + (token[0] if isinstance(token, list) else repr(token))
+
+
+def iter_token_records(token_list, depth=0) -> Iterator[dict]:
+    """One dict per token, in the order of `iter_token_lines`. Like `tree.iter_ast_records`."""
+    for token_depth, token in iter_token_tree(token_list, depth):
+        yield {'depth': token_depth, 'rule': token[0]} if isinstance(token, list) else \
+            {'depth': token_depth, 'text': token}
+
+
+def parse_source(grammar: Dict[str, Tuple[List[str]]], text: str, max_steps: Union[int, None] = None,
+                 source_map: Union[SourceMap, None] = None):
+    """Parse a whole program, or raise a SourceSyntaxError saying where it went wrong.
+
+    `parse` happily returns whatever it managed to parse and the remainder. This is what we want for a compiler.
+    We report the furthest position the parser reached: it's usually where the actual mistake is.
+
+    :param max_steps: give up after that many `parse_atom` calls. 0 to never give up, None for a default budget
+    proportional to the size of the text.
+    :param source_map: to report positions in the original source (before preprocessing).
+    """
+    if not text:
+        return None
+
+    if source_map is None:
+        source_map = SourceMap(text, [0], [0])
+
+    context = ParseContext(grammar, max_steps=default_max_steps(text) if max_steps is None else max_steps or None)
+
+    try:
+        token_list, remainder = parse_atom(grammar, 'Wrap', text, context=context)
+    except ParseLimitExceeded as e:
+        raise context.syntax_error(text, str(e), len(text), source_map) from None
+    except ParseError:
+        raise context.syntax_error(text, 'invalid syntax', len(text), source_map) from None
+
+    if remainder.strip():
+        raise context.syntax_error(text, 'invalid syntax', len(remainder) - re.match(r'\s*', remainder).end(),
+                                   source_map)
+    return token_list
+
+
 def to_ast(token_list) -> tree.AstNode:
 
     class_name, *args = token_list
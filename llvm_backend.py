@@ -1,11 +1,14 @@
 import contextlib
-from typing import Union
+import hashlib
+import itertools
+import re
+from typing import Callable, Iterable, Iterator, List, TextIO, Tuple, Union
 
 from llvmlite import ir
-from llvmlite.ir import NamedValue
 
 from tree import Function, Return, Integer, AstNode, BodyBlock, FunctionArgs, FunctionCall, \
-    FunctionCallArgs, Declaration, Assignment, Char, BinOp, UnOp, Wrap, String, Identifier, If, ForLoop
+    Declaration, Assignment, Char, BinOp, UnOp, Wrap, String, Identifier, If, ForLoop
+from type_inference import function_types, TypeInferenceError, BOOL, CHAR, INT, STRING
 
 
 class CustomBuilder(ir.IRBuilder):
@@ -28,26 +31,24 @@ class CustomBuilder(ir.IRBuilder):
                 self.branch(bbexit)
 
     @contextlib.contextmanager
-    def for_loop(self, condition_varname: str):
+    def for_loop(self, condition: Callable[[], ir.Value], loop_metadata: Union[ir.MDValue, None] = None):
         """I want a behavior similar to `ir.IRBuilder.if_else`.
         I did not find anything for this!! This is a bit weird even though they might be into 'vectorization' since
         llvmlite is maintained by Numba.
 
-        with build.for_loop() as (condition, incr, loop):
-            with condition:
-                # The condition code. We need a block here as opposed to when we use a if statement.
+        with build.for_loop(lambda: <the condition code, returning a boolean (ir.IntType(1))>) as (incr, loop):
             with incr:
                 # The increment code
             with loop:
                 # Do stuff in for loop body
 
-        :param condition_varname: the variable name that will store the computed condition bool in the condition block.
-        We need this so we can pre-write branching.
+        :param condition: generates the condition code. It's called with the builder in the condition block: we need a
+        block here as opposed to when we use a if statement, the condition will run several times.
+        :param loop_metadata: goes on the branch back to the condition, see `loop_metadata`.
 
         This code is heavily inspired by `if_else`.
         """
         bb = self.basic_block
-        # We need a for condition block because this condition will run several times (unlike in an if statement)
         bbcond = self.append_basic_block(name=bb.name + '.forcondition')
         bbincr = self.append_basic_block(name=bb.name + '.forincrement')
         bbbody = self.append_basic_block(name=bb.name + '.for')
@@ -56,32 +57,43 @@ class CustomBuilder(ir.IRBuilder):
         # In the current block we always redirect to the for condition. No questions asked.
         self.branch(bbcond)
 
-        # Same at the end of bbincr
+        # condition: jump out of loop when not met.
+        self.position_at_end(bbcond)
+        self.cbranch(condition(), bbbody, bbend)
+
+        # Same at the end of bbincr. That's the way back into the loop: where LLVM looks for what we know about it.
         self.position_at_end(bbincr)
-        self.branch(bbcond)
+        back_edge = self.branch(bbcond)
+        if loop_metadata is not None:
+            back_edge.set_metadata('llvm.loop', loop_metadata)
 
         # At the end of the body we go to incr
         self.position_at_end(bbbody)
         self.branch(bbincr)
 
         # I think the value yielded by _branch_helper is irrelevant: we won't use it and yielding it does affect state.
-        for_cond = self._branch_helper_goto_start(bbcond, bbend, add_terminal=False)
         for_incr = self._branch_helper_goto_start(bbincr, bbend)
         for_body = self._branch_helper_goto_start(bbbody, bbend)
-        yield for_cond, for_incr, for_body
+        yield for_incr, for_body
 
-        # HACK WARNING.
-        # I tried using a NamedValue but llvmlite does a good job of deduplicating names so if we use a name twice it
-        # will create 2 different names .
+        self.position_at_end(bbend)
 
-        # condition: jump out of loop when not met.
-        self.position_at_end(bbcond)
-        condition_value = NamedValue(bbcond, ir.IntType(1), condition_varname)
-        # the name will be deduplicated: we don't want that (if var already exists we will get var.1)! We override it.
-        condition_value._name = condition_varname
-        self.cbranch(condition_value, bbbody, bbend)
+    def entry_alloca(self, typ: ir.Type, name: str = '') -> ir.AllocaInstr:
+        """An alloca at the start of the function, wherever the builder is.
 
-        self.position_at_end(bbend)
+        An alloca in a loop grabs more stack every time around, and LLVM only turns into registers the allocas of the
+        entry block. So all our variables live there, in the order they were declared.
+        """
+        entry = self.function.entry_basic_block
+        index = 0
+        while index < len(entry.instructions) and isinstance(entry.instructions[index], ir.AllocaInstr):
+            index += 1
+        alloca = ir.AllocaInstr(entry, typ, None, name)
+        entry.instructions.insert(index, alloca)
+        if self.block is entry and self._anchor >= index:
+            # We just pushed down the instructions after it, the one the builder inserts before included.
+            self._anchor += 1
+        return alloca
 
 
 class LlvmConverterState:
@@ -94,25 +106,194 @@ class LlvmConverterState:
         # Mb some kind of scope concerns later on though.
         # We dont have the args variables when we're just writing the function declaration though
         self.identifier_to_var = {}
+        # Function name => C types of the return value and of the args. We need them to call a function.
+        self.return_types = {}
+        self.arg_types = {}
+        # For the function being generated: the C type of each expression (by node id, see `type_inference`) and the
+        # return type.
+        self.types = {}
+        self.return_type = None
+        # (C type, value) => ir.Constant, see `constant`.
+        self.constants = {}
+        # When the function being generated calls itself in a `return`: the block its body starts with, where such a
+        # call jumps instead (see `tail_call_to_loop`). None otherwise.
+        self.tail_recursion_block = None
+        # `--instrument`: where the program writes its counts when it exits. None when we don't instrument.
+        self.instrument = None
+        # (counter, function name, block name, node index), see `count_blocks`.
+        self.counters = []
+        # Block of the function being generated => the node it was created for, see `blocks_of`.
+        self.block_nodes = {}
+        # The unroll count we suggest to LLVM for our loops, 0 to let it decide. See `loop_metadata`.
+        self.unroll_count = 0
 
 
 llvm_converter_state = LlvmConverterState()
 
 
+@contextlib.contextmanager
+def fresh_state():
+    """A brand new `llvm_converter_state` in the `with`, the previous one is back after. Nothing from a compilation
+    leaks into another one that way, even one that failed halfway."""
+    global llvm_converter_state
+    previous = llvm_converter_state
+    llvm_converter_state = LlvmConverterState()
+    try:
+        yield llvm_converter_state
+    finally:
+        llvm_converter_state = previous
+
+
+def new_module() -> ir.Module:
+    module = ir.Module('generated', )
+    # I got the triple from compiling a C program on my machine.
+    module.triple = "x86_64-unknown-linux-gnu"
+    # Functions from a previous module are no use here.
+    llvm_converter_state.functions = {}
+    llvm_converter_state.return_types = {}
+    llvm_converter_state.arg_types = {}
+    llvm_converter_state.constants = {}
+    llvm_converter_state.instrument = None
+    llvm_converter_state.counters = []
+    llvm_converter_state.unroll_count = 0
+    return module
+
+
+def module_header(module: ir.Module) -> str:
+    """What `str(module)` starts with, before the functions."""
+    return '\n'.join([f'; ModuleID = "{module.name}"', f'target triple = "{module.triple}"',
+                      f'target datalayout = "{module.data_layout}"', ''])
+
+
+def iter_llvm(statements: Iterable[AstNode], instrument: Union[str, None] = None, unroll_count: int = 0) \
+        -> Iterator[str]:
+    """The IR of a program, piece by piece: the module header, then each function as soon as it is generated (with the
+    strings and external functions it brought along).
+
+    Once a function is out we throw its body away and only keep its declaration, for the functions that call it. So we
+    never hold much more than one function in memory, and `statements` can be a generator.
+
+    :param instrument: the program counts how many times each block runs, and writes the counts to that file when it
+    exits. See `count_blocks` and `instrumentation_map`.
+    :param unroll_count: see `loop_metadata`.
+    """
+    module = new_module()
+    llvm_converter_state.instrument = instrument
+    llvm_converter_state.unroll_count = unroll_count
+    yield module_header(module)
+    written = 0
+    for statement in itertools.chain(statements, [None]):
+        if statement is not None:
+            to_llvm(statement, None, module)
+        elif instrument is not None:
+            # All the counters are known now.
+            dump_counts_to_llvm(instrument, module)
+        # Everything new in the module, in the order `str(module)` would show it.
+        new_globals = list(itertools.islice(module.globals.values(), written, None))
+        written += len(new_globals)
+        for global_value in new_globals:
+            yield '\n' + str(global_value)
+            if isinstance(global_value, ir.Function) and global_value.blocks:
+                # No blocks makes it a declaration. That's all the following functions need.
+                global_value.blocks = []
+                # The names of the instructions we just threw away.
+                global_value.scope = global_value.scope.__class__()
+    # Metadata comes last, in `str(module)` too.
+    for metadata in module.metadata:
+        yield '\n' + str(metadata)
+    yield '\n'
+
+
+def write_llvm(node: Wrap, stream: TextIO):
+    """Same output as `print(to_llvm(node), file=stream)`, written one function at a time."""
+    for piece in iter_llvm(node.statements):
+        stream.write(piece)
+
+
+class CodegenError(Exception):
+    pass
+
+
+def declare_function(node: Function, module: ir.Module) -> ir.Function:
+    """Declare a function without generating its body. That's all we need to call it."""
+    check_new_function(node.name.name)
+    f_type = ir.FunctionType(type_to_llvm_type[node.return_type],
+                             tuple(type_to_llvm_type[arg.type] for arg in node.args.args))
+    f = ir.Function(module, f_type, node.name.name)
+    register_function(node, f)
+    return f
+
+
+def register_function(node: Function, f: ir.Function):
+    llvm_converter_state.functions[node.name.name] = f
+    llvm_converter_state.return_types[node.name.name] = node.return_type
+    llvm_converter_state.arg_types[node.name.name] = [arg.type for arg in node.args.args]
+
+
+def check_new_function(name: str):
+    if name not in llvm_converter_state.functions:
+        return
+    if llvm_converter_state.arg_types[name] is None:
+        # The calls before it have it variadic, and they might be written already (see `iter_llvm`).
+        raise CodegenError(f'{name} is called before it is defined. Define it before its first call.')
+    raise CodegenError(f'{name} is defined twice')
+
+
+def declare_implicit_function(name: str, module: ir.Module) -> ir.Function:
+    """A function we call without knowing it, like `puts`. It's for the linker to find.
+
+    Like C89 does, we assume it returns an int. It's variadic so it accepts whatever we give it.
+    """
+    f = ir.Function(module, ir.FunctionType(type_to_llvm_type[INT], (), var_arg=True), name)
+    llvm_converter_state.functions[name] = f
+    llvm_converter_state.return_types[name] = INT
+    # No prototype: see `to_llvm` for the arguments.
+    llvm_converter_state.arg_types[name] = None
+    return f
+
+
+def declare_globals(node: Function, module: ir.Module):
+    """Add to the module what the body of the function would: its strings and the functions it calls without knowing
+    them. For when we have the IR of the function already."""
+    for child in node.body.walk():
+        if isinstance(child, String):
+            intern_string(child.value, module)
+        elif isinstance(child, FunctionCall) and child.function_id.name not in llvm_converter_state.functions:
+            declare_implicit_function(child.function_id.name, module)
+
+
 def function_to_llvm(node: Function, module: ir.Module):
     assert module is not None
 
+    # Variables are local to a function. Without this a function could see the variables of the previous one.
+    llvm_converter_state.identifier_to_var = {}
+    llvm_converter_state.arg_identifiers_to_index = {}
+
     args = to_llvm(node.args, None, module) if node.args is not None else tuple([])
-    # Hardcoded type...
-    f_type = ir.FunctionType(ir.IntType(64), args)
+    f_type = ir.FunctionType(type_to_llvm_type[node.return_type], args)
 
     # node.name is a Identifier node. So node.name.name. Thumbs up.
+    check_new_function(node.name.name)
     f = ir.Function(module, f_type, node.name.name)
-    llvm_converter_state.functions[node.name.name] = f
+    # Before looking at the body: the function might call itself.
+    register_function(node, f)
+    llvm_converter_state.types = function_types(node, llvm_converter_state.return_types)
+    llvm_converter_state.return_type = node.return_type
     # TODO: Does variable declaration in function arguments require a block?... I dont have one until now.
     # I think argument declaration requires
     block = f.append_basic_block(name='entry')
     builder = CustomBuilder(block)
+    llvm_converter_state.block_nodes = {}
+    llvm_converter_state.tail_recursion_block = None
+    if any(is_self_tail_call(child, node.name.name) for child in node.body.walk()):
+        # The args become variables: the loop gives them new values.
+        for arg, value in zip(node.args.args, f.args):
+            variable = builder.entry_alloca(value.type, name=arg.identifier.name)
+            builder.store(value, variable)
+            llvm_converter_state.identifier_to_var[arg.identifier.name] = variable
+        llvm_converter_state.tail_recursion_block = f.append_basic_block(name='tailrecurse')
+        builder.branch(llvm_converter_state.tail_recursion_block)
+        builder.position_at_end(llvm_converter_state.tail_recursion_block)
     to_llvm(node.body, builder, module)
 
     # This is to fix empty blocks: they are not accepted by LLVM IR. Every block is supposed to have a terminator.
@@ -120,28 +301,160 @@ def function_to_llvm(node: Function, module: ir.Module):
     # For instance `if` creates an extra block and it crashes if there's nothing in it.
     if not builder.block.instructions:
         builder.unreachable()
+    if llvm_converter_state.instrument is not None:
+        count_blocks(node, f, module)
     return module
 
 
-def return_to_llvm(node: Return, builder: CustomBuilder):
+def return_to_llvm(node: Return, builder: CustomBuilder, module: ir.Module):
     """This function modifies builder inplace. It's a bit weird as it's not super consistent with other converters."""
-    return builder.ret(to_llvm(node.value, builder))
-
-
-def string_to_llvm(node):
-    # TODO: maybe do int arithmetic before.
-    pass
-
-
-def char_to_llvm(node, builder, module):
-    # A char in C is just an integer (with 8 bits of storage but we dont care about this)
-    return to_llvm(Integer(ord(node.value)), builder, module)
-
-
-type_to_llvm_type = {'int': ir.IntType(64),
-                     'char': ir.IntType(64)  # Not accurate/optimal. Whatever.
+    if isinstance(node.value, FunctionCall):
+        # A call in tail position: nothing left to do in this function once it returns.
+        if llvm_converter_state.tail_recursion_block is not None and \
+                is_self_tail_call(node, builder.function.name):
+            return tail_call_to_loop(node.value, builder, module)
+        value = call_to_llvm(node.value, builder, module, tail=True)
+        return builder.ret(convert(value, llvm_converter_state.types[id(node.value)], llvm_converter_state.return_type,
+                                   builder))
+    return builder.ret(expression_to_llvm(node.value, llvm_converter_state.return_type, builder, module))
+
+
+def is_self_tail_call(node: AstNode, function_name: str) -> bool:
+    """Is it `return f(...);` in the function `f`?"""
+    return isinstance(node, Return) and isinstance(node.value, FunctionCall) and \
+        node.value.function_id.name == function_name
+
+
+def tail_call_to_loop(node: FunctionCall, builder: CustomBuilder, module: ir.Module):
+    """`return f(a, b);` in `f` is `x = a; y = b;` and back to the start of the function. No stack used: deep recursion
+    does not overflow it. See `function_to_llvm` for the other half."""
+    indexes = llvm_converter_state.arg_identifiers_to_index
+    names = sorted(indexes, key=indexes.get)
+    args = node.args.args if node.args else []
+    arg_types = llvm_converter_state.arg_types[node.function_id.name]
+    # All the new values before any store: in `return f(b, a);` the second arg is the old `a`.
+    values = [expression_to_llvm(arg, arg_type, builder, module) for arg, arg_type in zip(args, arg_types)]
+    for name, value in zip(names, values):
+        builder.store(value, llvm_converter_state.identifier_to_var[name])
+    return builder.branch(llvm_converter_state.tail_recursion_block)
+
+
+C_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v', '\\': '\\',
+             "'": "'", '"': '"', '?': '?'}
+
+
+def string_bytes(value: str) -> bytes:
+    """What a C string literal is made of: its characters, escape sequences replaced, and a null byte at the end."""
+    return re.sub(r'\\(.)', lambda match: C_ESCAPES.get(match.group(1), match.group(1)), value).encode() + b'\0'
+
+
+def intern_string(value: str, module: ir.Module) -> ir.GlobalVariable:
+    """The global constant with the content of a string literal. There's one per content in a module.
+
+    The name comes from the content, so it's the same whatever function created it (see `incremental_build`).
+    """
+    data = string_bytes(value)
+    name = 'str.' + hashlib.sha1(data).hexdigest()[:16]
+    try:
+        return module.get_global(name)
+    except KeyError:
+        pass
+    array_type = ir.ArrayType(type_to_llvm_type[CHAR], len(data))
+    global_string = ir.GlobalVariable(module, array_type, name=name)
+    global_string.linkage = 'private'
+    global_string.global_constant = True
+    global_string.initializer = ir.Constant(array_type, bytearray(data))
+    return global_string
+
+
+def string_to_llvm(node: String, builder: CustomBuilder, module: ir.Module):
+    # A pointer to the first character.
+    zero = constant(INT, 0)
+    return builder.gep(intern_string(node.value, module), [zero, zero], inbounds=True)
+
+
+def char_to_llvm(node: Char):
+    # 'a' is an int in C (see `type_inference`).
+    return constant(INT, ord(node.value))
+
+
+# Not in the C we compile: the counters of `--instrument`, see `count_blocks`.
+COUNTER = 'long long'
+
+# Created once and for all: llvmlite types are immutable, we can share them.
+type_to_llvm_type = {'int': ir.IntType(32),
+                     'char': ir.IntType(8),
+                     # Not a C type. What comparisons give us, see `type_inference`.
+                     BOOL: ir.IntType(1),
+                     STRING: ir.IntType(8).as_pointer(),
+                     COUNTER: ir.IntType(64),
                      }
 
+# Constants in that range are shared by all their uses in a compilation. Generated code uses the same few constants over
+# and over. Bigger ones are rare, we don't want to keep all of them around.
+SMALL_CONSTANTS = range(-1024, 1024)
+
+
+def constant(c_type: str, value: int) -> ir.Constant:
+    """A constant of one of our integer types. Like types, constants are immutable: no need for a new one every time.
+
+    That also saves llvmlite some work: it formats a constant once, however many instructions use it.
+    """
+    if value not in SMALL_CONSTANTS:
+        return ir.Constant(type_to_llvm_type[c_type], value)
+    key = (c_type, value)
+    try:
+        return llvm_converter_state.constants[key]
+    except KeyError:
+        llvm_converter_state.constants[key] = result = ir.Constant(type_to_llvm_type[c_type], value)
+        return result
+
+
+def convert(value: ir.Value, from_type: str, to_type: str, builder: CustomBuilder) -> ir.Value:
+    """Convert between our integer types, the way C does."""
+    if from_type == to_type:
+        return value
+    if STRING in (from_type, to_type):
+        raise TypeInferenceError(f'Cannot use a {from_type} as a {to_type}')
+    if to_type == BOOL:
+        return builder.icmp_signed('!=', value, constant(from_type, 0))
+    llvm_type = type_to_llvm_type[to_type]
+    if isinstance(value, ir.Constant):
+        # No need for an instruction to know what `(char) 65` is.
+        half = 1 << (llvm_type.width - 1)
+        return constant(to_type, (value.constant + half) % (1 << llvm_type.width) - half)
+    if from_type == BOOL:
+        # true is 1, not -1: no sign extension here.
+        return builder.zext(value, llvm_type)
+    if value.type.width < llvm_type.width:
+        return builder.sext(value, llvm_type)
+    return builder.trunc(value, llvm_type)
+
+
+def promote(c_type: str) -> str:
+    """Integer promotion: what's smaller than an int becomes an int."""
+    return INT if c_type in (CHAR, BOOL) else c_type
+
+
+def expression_to_llvm(node: AstNode, c_type: str, builder: CustomBuilder, module: Union[ir.Module, None]) -> ir.Value:
+    """The value of the expression `node`, converted to `c_type`."""
+    return convert(to_llvm(node, builder, module), llvm_converter_state.types[id(node)], c_type, builder)
+
+
+# Methods of the builder, for each operator. Comparisons are all done with `icmp_signed`.
+binop_to_method = {
+    BinOp.ADD: CustomBuilder.add,
+    BinOp.SUBSTRACT: CustomBuilder.sub,
+    BinOp.MULTIPLY: CustomBuilder.mul,
+    # sdiv for signed integer division. I think there's a subtlety here.
+    BinOp.DIVIDE: CustomBuilder.sdiv,
+    BinOp.MODULO: CustomBuilder.srem
+}
+
+# +(expr) is a noop --> (expr). This is probably not very accurate. `!` is not here, see `to_llvm`.
+unop_to_method = {UnOp.MINUS: CustomBuilder.neg, UnOp.COMPLEMENT: CustomBuilder.not_,
+                  UnOp.PLUS: lambda builder, value: value}
+
 
 def to_llvm(node: AstNode, builder: Union[CustomBuilder, None] = None, module: Union[ir.Module, None] = None):
     if isinstance(node, Function):
@@ -161,76 +474,59 @@ def to_llvm(node: AstNode, builder: Union[CustomBuilder, None] = None, module: U
             arg_list.append(type_to_llvm_type[arg.type])
         return tuple(arg_list)
     if isinstance(node, FunctionCall):
-        args = [] if not node.args else to_llvm(node.args, builder, module)
-        return builder.call(llvm_converter_state.functions[node.function_id.name], args)
-    if isinstance(node, FunctionCallArgs):
-        arg_list = []
-        for arg in node.args:
-            arg_list.append(to_llvm(arg, builder, module))
-        return arg_list
+        return call_to_llvm(node, builder, module)
     if isinstance(node, Declaration):
-        variable = builder.alloca(type_to_llvm_type[node.type], name=node.identifier.name)
+        # The value first: in `int a = a;`, the second `a` is not this one.
+        value = expression_to_llvm(node.value, node.type, builder, module) if node.value is not None else None
+        variable = builder.entry_alloca(type_to_llvm_type[node.type], name=node.identifier.name)
         llvm_converter_state.identifier_to_var[node.identifier.name] = variable
-        if node.value is not None:
-            return builder.store(to_llvm(node.value, builder, module), variable)
+        if value is not None:
+            return builder.store(value, variable)
         else:
             return variable
 
     if isinstance(node, Assignment):
-        return builder.store(to_llvm(node.value, builder, module),
-                             llvm_converter_state.identifier_to_var[node.identifier.name])
+        # The value of `a = b` is the new value of `a`: it has the type of `a`.
+        value = expression_to_llvm(node.value, llvm_converter_state.types[id(node)], builder, module)
+        builder.store(value, llvm_converter_state.identifier_to_var[node.identifier.name])
+        return value
     if isinstance(node, Integer):
         return integer_to_llvm(node)
     if isinstance(node, Return):
-        return return_to_llvm(node, builder)
+        return return_to_llvm(node, builder, module)
     if isinstance(node, Char):
-        return char_to_llvm(node, builder, module)
+        return char_to_llvm(node)
     if isinstance(node, BinOp):
-        left = to_llvm(node.left, builder, module)
-        right = to_llvm(node.right, builder, module)
-
-        operation_to_method = {
-            BinOp.ADD: builder.add,
-            BinOp.SUBSTRACT: builder.sub,
-            BinOp.MULTIPLY: builder.mul,
-            # sdiv for signed integer division. I think there's a subtlety here.
-            BinOp.DIVIDE: builder.sdiv,
-            BinOp.MODULO: builder.srem
-        }
+        # Usual arithmetic conversions: everything is done on ints, even `char < char`.
+        left = expression_to_llvm(node.left, INT, builder, module)
+        right = expression_to_llvm(node.right, INT, builder, module)
 
         try:
-            method = operation_to_method[node.operation]
+            method = binop_to_method[node.operation]
         except KeyError:
-            def compare_and_upcast(left, right):
-                return builder.zext(builder.icmp_signed(node.operation, left, right), ir.IntType(64))
-
-            method = compare_and_upcast
+            # A comparison. We keep the IntType(1) that icmp_signed returns, it's only extended if it has to be.
+            return builder.icmp_signed(node.operation, left, right)
 
-        return method(left, right)
+        return method(builder, left, right)
 
     if isinstance(node, UnOp):
-        def logical_not(value):
-            """!a is 1 if a is 0, else 0."""
-            # We need to upcast the IntType(1) that icmp_signed returns so it matches the `main` return type.
-            # Or whatever type is required.
-            return builder.zext(builder.icmp_signed('==', value, ir.Constant(ir.IntType(64), 0)), ir.IntType(64))
-
-        # +(expr) is a noop --> (expr). This is probably not very accurate.
-        operation_to_method = {UnOp.MINUS: builder.neg, UnOp.COMPLEMENT: builder.not_, UnOp.PLUS: lambda v: v,
-                               UnOp.NOT: logical_not}
-
-        method = operation_to_method[node.operation]
-        value = to_llvm(node.operand, builder, module)
-        return method(value)
+        if node.operation == UnOp.NOT:
+            # !a is true if a is 0, else false.
+            value = to_llvm(node.operand, builder, module)
+            operand_type = llvm_converter_state.types[id(node.operand)]
+            if operand_type == BOOL:
+                return builder.not_(value)
+            return builder.icmp_signed('==', value, constant(operand_type, 0))
+
+        value = expression_to_llvm(node.operand, INT, builder, module)
+        return unop_to_method[node.operation](builder, value)
     if isinstance(node, Wrap):
-        module = ir.Module('generated', )
-        # I got the triple from compiling a C program on my machine.
-        module.triple = "x86_64-unknown-linux-gnu"
+        module = new_module()
         for statement in node.children:
             to_llvm(statement, builder, module=module)
         return module
     if isinstance(node, String):
-        return string_to_llvm(node)
+        return string_to_llvm(node, builder, module)
 
     if isinstance(node, Identifier):
         # Here we're just using an identifier 'alone' in an expr (not assigning to it) -> We want to get the value!
@@ -242,44 +538,248 @@ def to_llvm(node: AstNode, builder: Union[CustomBuilder, None] = None, module: U
 
         return builder.load(var)
     if isinstance(node, If):
-        # We cant just throw the condition to llvm: it expects a type of i1 (boolean, 1/0).
-        # If node.condition is an Integer, we compare to 0 for instance.
-        predicate = condition_to_llvm(node.condition, builder, module)
-        if node.else_block is None:
-            with builder.if_then(predicate) as then:
-                to_llvm(node.if_block, builder, module)
-        else:
-            with builder.if_else(predicate) as (then, otherwise):
-                with then:
+        with blocks_of(node, builder):
+            chain = switch_chain(node)
+            if chain is not None:
+                return switch_to_llvm(*chain, builder, module)
+            # We cant just throw the condition to llvm: it expects a type of i1 (boolean, 1/0).
+            # If node.condition is an Integer, we compare to 0 for instance.
+            predicate = condition_to_llvm(node.condition, builder, module)
+            if node.else_block is None:
+                with builder.if_then(predicate) as then:
                     to_llvm(node.if_block, builder, module)
-                with otherwise:
-                    to_llvm(node.else_block, builder, module)
+            else:
+                with builder.if_else(predicate) as (then, otherwise):
+                    with then:
+                        to_llvm(node.if_block, builder, module)
+                    with otherwise:
+                        to_llvm(node.else_block, builder, module)
 
     if isinstance(node, ForLoop):
-        cond_varname = 'forcond'
         to_llvm(node.for_init, builder, module)
-        with builder.for_loop(cond_varname) as (condition, incr, loop):
-            with condition:
-                condition_to_llvm(node.for_condition, builder, module, varname=cond_varname)
-            with incr:
-                to_llvm(node.for_increment, builder, module)
-            with loop:
-                to_llvm(node.for_body, builder, module)
-
-
-def condition_to_llvm(node, builder: CustomBuilder, module, varname=''):
-    # Might make sense to do it in the AST instead? It's hard to know the type in the AST though.
-    # Works out nicely in the end!
+        with blocks_of(node, builder):
+            condition = lambda: condition_to_llvm(node.for_condition, builder, module)  # noqa: E731
+            with builder.for_loop(condition, loop_metadata(module)) as (incr, loop):
+                with incr:
+                    to_llvm(node.for_increment, builder, module)
+                with loop:
+                    to_llvm(node.for_body, builder, module)
+
+
+def call_to_llvm(node: FunctionCall, builder: CustomBuilder, module: ir.Module, tail: bool = False):
+    """:param tail: the call is in tail position. LLVM can then reuse our stack frame for it. We have no pointers to our
+    variables, the callee cannot need them."""
+    name = node.function_id.name
+    if name not in llvm_converter_state.functions:
+        declare_implicit_function(name, module)
+    function = llvm_converter_state.functions[name]
+    args = node.args.args if node.args else []
+    arg_types = llvm_converter_state.arg_types[name]
+    if arg_types is None:
+        # Without a prototype C promotes chars to ints, that's all.
+        arg_types = [promote(llvm_converter_state.types[id(arg)]) for arg in args]
+    args = [expression_to_llvm(arg, arg_type, builder, module) for arg, arg_type in zip(args, arg_types)]
+    # Only a hint (`tail`, not `musttail`: llvmlite 0.20 can't write that). LLVM makes it a jump when it can.
+    return builder.call(function, args, tail=tail)
+
+
+class LoopMetadata(ir.MDValue):
+    """`!3 = distinct !{!3, hints...}`. LLVM wants the metadata of a loop to start with itself, so that no two loops
+    share it. llvmlite can't write that, and hashes its metadata by content: this one can't be in its own content."""
+
+    def descr(self, buf):
+        buf += ('distinct !{{ {0} }}'.format(', '.join([self.get_reference()] + [hint.get_reference()
+                                                                               for hint in self.operands])), '\n')
+
+
+def new_metadata(module: ir.Module, operands: list, cls=ir.MDValue) -> ir.MDValue:
+    """Unlike `module.add_metadata`, a new one every time: the metadata of a function is then all its own, in one piece
+    (see `incremental_build`)."""
+    return cls(module, operands, name=str(len(module.metadata)))
+
+
+def loop_metadata(module: ir.Module) -> LoopMetadata:
+    """What we tell LLVM about a loop: vectorize it, and unroll it `llvm_converter_state.unroll_count` times (or as
+    many times as it sees fit if that's 0). It only matters when the IR is optimized."""
+    hints = [new_metadata(module, [ir.MetaDataString(module, 'llvm.loop.vectorize.enable'),
+                                   ir.Constant(type_to_llvm_type[BOOL], 1)])]
+    if llvm_converter_state.unroll_count:
+        hints.append(new_metadata(module, [ir.MetaDataString(module, 'llvm.loop.unroll.count'),
+                                           constant(INT, llvm_converter_state.unroll_count)]))
+    else:
+        hints.append(new_metadata(module, [ir.MetaDataString(module, 'llvm.loop.unroll.enable')]))
+    return new_metadata(module, hints, cls=LoopMetadata)
+
+
+# Below that, a couple of if/else do just as well as a switch.
+MIN_SWITCH_CASES = 3
+
+
+def switch_case(condition: AstNode) -> Union[Tuple[str, int], None]:
+    """('x', 3) for `x == 3` or `3 == x` (chars count as constants). None for any other condition."""
+    if not isinstance(condition, BinOp) or condition.operation != BinOp.EQ:
+        return None
+    for variable, value in [(condition.left, condition.right), (condition.right, condition.left)]:
+        if isinstance(variable, Identifier) and isinstance(value, (Integer, Char)):
+            return variable.name, value.value if isinstance(value, Integer) else ord(value.value)
+    return None
+
+
+def switch_chain(node: If) -> Union[Tuple[Identifier, List[Tuple[int, BodyBlock]], Union[BodyBlock, None]], None]:
+    """Recognize `if (x == 1) ... else if (x == 2) ... else ...`: the same variable against constants.
+
+    Return the variable, the (value, block) cases and the final else block (None if there's none). None if `node` is not
+    such a chain, or too short to be worth a switch.
+    """
+    first_case = switch_case(node.condition)
+    if first_case is None:
+        return None
+    name = first_case[0]
+    cases = []
+    seen = set()
+    default = node
+    # An `else if` is an else block with an `If` alone in it.
+    while isinstance(default, If):
+        case = switch_case(default.condition)
+        if case is None or case[0] != name:
+            # Whatever is left is the default: `else if (y == 2)` works like `else { if (y == 2) ... }`.
+            default = BodyBlock([default])
+            break
+        # Only the first `x == 1` can be true, the next ones are dead code.
+        if case[1] not in seen:
+            seen.add(case[1])
+            cases.append((case[1], default.if_block))
+        else_block = default.else_block
+        statements = else_block.statements if else_block is not None else []
+        default = statements[0] if len(statements) == 1 and isinstance(statements[0], If) else else_block
+    if len(cases) < MIN_SWITCH_CASES:
+        return None
+    variable = node.condition.left if isinstance(node.condition.left, Identifier) else node.condition.right
+    return variable, cases, default
+
+
+def switch_to_llvm(variable: Identifier, cases: List[Tuple[int, BodyBlock]], default: Union[BodyBlock, None],
+                   builder: CustomBuilder, module: ir.Module):
+    """One `switch` instead of a chain of comparisons and branches: the variable is read once, and LLVM can make it a
+    jump table."""
+    # Compared as ints, like `x == 1` does.
+    value = expression_to_llvm(variable, INT, builder, module)
+    name = builder.basic_block.name
+    # Adding blocks does not move the builder: we can have them all, in reading order, before the switch.
+    blocks = [(builder.append_basic_block(name=name + '.case'), block) for _, block in cases]
+    if default is not None:
+        blocks.append((builder.append_basic_block(name=name + '.default'), default))
+    bbend = builder.append_basic_block(name=name + '.endswitch')
+
+    switch = builder.switch(value, blocks[-1][0] if default is not None else bbend)
+    for (case_value, _), (bbcase, _) in zip(cases, blocks):
+        switch.add_case(constant(INT, case_value), bbcase)
+
+    for bb, block in blocks:
+        builder.position_at_end(bb)
+        to_llvm(block, builder, module)
+        if builder.block.terminator is None:
+            builder.branch(bbend)
+    builder.position_at_end(bbend)
+
+
+def condition_to_llvm(node, builder: CustomBuilder, module):
+    # `type_inference` tells us when the condition is already a boolean: comparisons and `!`. Nothing to do then.
     condition = to_llvm(node, builder, module)
+    condition_type = llvm_converter_state.types[id(node)]
+    if condition_type == BOOL:
+        return condition
 
     if isinstance(condition.type, ir.IntType):
-        # If it's already a boolean (ir.IntType(1)) we cast it to int64. Compare it to 0. Get a boolean. Great!
-        return builder.icmp_signed('!=', to_llvm(node, builder, module), ir.Constant(ir.IntType(64), 0), name=varname)
+        # Compare it to 0. Get a boolean. Great!
+        return builder.icmp_signed('!=', condition, constant(condition_type, 0))
     else:
         raise NotImplementedError('Lazy developer does not implement what does not crash')
 
 
 def integer_to_llvm(node: Integer):
-    # mb some kind of optimization on the number of bits. 64 is the safe I-dont-wanna-hear-about-it way.
-    i_type = ir.IntType(64)
-    return ir.Constant(i_type, node.value)
\ No newline at end of file
+    # An int, like in C.
+    return constant(INT, node.value)
+
+# Instrumentation (`--instrument`): a counter per block, incremented every time the block runs. The counts are written
+# to a file when the program exits, one per line, in the order of `llvm_converter_state.counters`.
+
+
+@contextlib.contextmanager
+def blocks_of(node: AstNode, builder: CustomBuilder):
+    """The blocks created in the `with` belong to `node`, except those of the nodes inside it: they claimed theirs
+    first. So we can tell which `if` or `for` a block is part of."""
+    first = len(builder.function.blocks)
+    yield
+    for block in builder.function.blocks[first:]:
+        llvm_converter_state.block_nodes.setdefault(block, node)
+
+
+def count_blocks(node: Function, f: ir.Function, module: ir.Module):
+    """Add a counter to each block of `f`. The ones that no `if` or `for` claimed (like 'entry', which counts the calls)
+    belong to the function."""
+    node_indexes = {id(child): index for index, child in enumerate(node.walk())}
+    builder = CustomBuilder()
+    for block in f.blocks:
+        counter = ir.GlobalVariable(module, type_to_llvm_type[COUNTER], name=f'count.{f.name}.{block.name}')
+        counter.linkage = 'internal'
+        counter.initializer = constant(COUNTER, 0)
+        owner = llvm_converter_state.block_nodes.get(block, node)
+        llvm_converter_state.counters.append((counter, f.name, block.name, node_indexes[id(owner)]))
+
+        # After the allocas: LLVM likes them first in the entry block.
+        builder.position_before(next(instruction for instruction in block.instructions
+                                     if not isinstance(instruction, ir.AllocaInstr)))
+        builder.store(builder.add(builder.load(counter), constant(COUNTER, 1)), counter)
+
+
+def instrumentation_map() -> List[dict]:
+    """What the counts written by the instrumented program are about, in the same order: the function, the name of the
+    block and the node it belongs to (its index in `function_node.walk()`). See `profile_report.py`."""
+    return [{'function': function, 'block': block, 'node': node_index}
+            for _, function, block, node_index in llvm_converter_state.counters]
+
+
+def libc_function(name: str, f_type: ir.FunctionType, builder: CustomBuilder) -> ir.Value:
+    """A libc function to call with `builder`, of type `f_type`. If the program has it already (called without a
+    prototype, variadic, or defined with other types), cast to `f_type`: it's the same function for the linker."""
+    module = builder.module
+    try:
+        function = module.get_global(name)
+    except KeyError:
+        return ir.Function(module, f_type, name)
+    if function.type == f_type.as_pointer():
+        return function
+    return builder.bitcast(function, f_type.as_pointer())
+
+
+def dump_counts_to_llvm(path: str, module: ir.Module):
+    """The function that writes the counts, and `llvm.global_dtors` to have it run when the program exits.
+
+    Why not `atexit`: lli does not find it, it's not a real function in glibc.
+    """
+    pointer = type_to_llvm_type[STRING]
+    dump = ir.Function(module, ir.FunctionType(ir.VoidType(), []), 'count.dump')
+    dump.linkage = 'internal'
+    builder = CustomBuilder(dump.append_basic_block(name='entry'))
+    fopen = libc_function('fopen', ir.FunctionType(pointer, [pointer, pointer]), builder)
+    fprintf = libc_function('fprintf', ir.FunctionType(type_to_llvm_type[INT], [pointer, pointer], var_arg=True),
+                            builder)
+    fclose = libc_function('fclose', ir.FunctionType(type_to_llvm_type[INT], [pointer]), builder)
+    zero = constant(INT, 0)
+    # `intern_string` wants C source, where backslashes are escapes.
+    path_string, mode, number_format = [builder.gep(intern_string(value, module), [zero, zero], inbounds=True)
+                                        for value in [path.replace('\\', '\\\\'), 'w', '%lld\\n']]
+    stream = builder.call(fopen, [path_string, mode])
+    with builder.if_then(builder.icmp_unsigned('!=', stream, ir.Constant(pointer, None))):
+        for counter, *_ in llvm_converter_state.counters:
+            builder.call(fprintf, [stream, number_format, builder.load(counter)])
+        builder.call(fclose, [stream])
+    builder.ret_void()
+
+    # 65535: the default priority, like a destructor in C++.
+    entry_type = ir.LiteralStructType([type_to_llvm_type[INT], dump.type, pointer])
+    destructors = ir.GlobalVariable(module, ir.ArrayType(entry_type, 1), name='llvm.global_dtors')
+    destructors.linkage = 'appending'
+    destructors.initializer = ir.Constant(ir.ArrayType(entry_type, 1), [
+        ir.Constant(entry_type, [constant(INT, 65535), dump, ir.Constant(pointer, None)])])
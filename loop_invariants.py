@@ -0,0 +1,91 @@
+"""Compute what does not change in a loop once, before it, on the ast, before generating IR.
+
+    for (i = 0; i < n * 2; i = i + 1) {
+        total = total + a * b + i;
+    }
+
+becomes:
+
+    int __hoisted_0 = n * 2;
+    int __hoisted_1 = a * b;
+    for (i = 0; i < __hoisted_0; i = i + 1) {
+        total = total + __hoisted_1 + i;
+    }
+
+What we hoist: arithmetic and comparisons on variables nothing in the loop assigns to or declares (constants alone, LLVM
+folds already). Only when they call nothing and don't divide: they run before the loop even if the loop never runs, or
+if they were behind an `if`. Computing `a * b` for nothing is fine, dividing by zero or calling `printf` is not. A
+comparison goes in an int, like `int x = a < b;` would.
+
+Loops are done outside in: what does not change in the outer loop does not change in the inner one either, and goes all
+the way out.
+"""
+import itertools
+from typing import Dict, Iterable, Iterator, List, Set
+
+from inliner import map_children
+from tree import AstNode, Assignment, BinOp, BodyBlock, Declaration, ForLoop, Function, FunctionCall, Identifier, If, \
+    String, UnOp
+from type_inference import rewrite_types, BOOL, INT
+
+
+def hoist_invariants(statements: Iterable[AstNode]) -> Iterator[AstNode]:
+    """The statements, with loop invariants hoisted. Changed in place, works on a generator too (see `streaming`)."""
+    return_types = {}
+    for statement in statements:
+        if isinstance(statement, Function):
+            return_types[statement.name.name] = statement.return_type
+            types = rewrite_types(statement, return_types)
+            if types is not None:
+                # Numbered in the function only, like in `inliner`.
+                hoist_in_block(statement.body, types, itertools.count())
+        yield statement
+
+
+def hoist_in_block(block: BodyBlock, types: Dict[int, str], counter: Iterator[int]):
+    statements = []
+    for statement in block.statements:
+        if isinstance(statement, ForLoop):
+            statements.extend(hoist_from_loop(statement, types, counter))
+            hoist_in_block(statement.for_body, types, counter)
+        elif isinstance(statement, If):
+            hoist_in_block(statement.if_block, types, counter)
+            if statement.else_block is not None:
+                hoist_in_block(statement.else_block, types, counter)
+        elif isinstance(statement, BodyBlock):
+            hoist_in_block(statement, types, counter)
+        statements.append(statement)
+    block.statements = statements
+
+
+def hoist_from_loop(loop: ForLoop, types: Dict[int, str], counter: Iterator[int]) -> List[Declaration]:
+    """Replace the invariants of the loop (condition, increment and body) by variables. Return their declarations, to
+    go before the loop. Even before its init: they don't use what it assigns to, it's part of the loop."""
+    changed = {child.identifier.name for child in loop.walk() if isinstance(child, (Assignment, Declaration))}
+    declarations = []
+
+    def hoist(node: AstNode) -> AstNode:
+        if isinstance(node, (BinOp, UnOp)) and is_invariant(node, changed, types):
+            name = f'__hoisted_{next(counter)}'
+            declarations.append(Declaration(INT, Identifier(name), node))
+            return Identifier(name)
+        map_children(node, hoist)
+        return node
+
+    for key in ['for_condition', 'for_increment', 'for_body']:
+        if getattr(loop, key) is not None:
+            setattr(loop, key, hoist(getattr(loop, key)))
+    return declarations
+
+
+def is_invariant(node: AstNode, changed: Set[str], types: Dict[int, str]) -> bool:
+    if types.get(id(node)) not in (INT, BOOL) or not any(isinstance(child, Identifier) for child in node.walk()):
+        return False
+    for child in node.walk():
+        if isinstance(child, (FunctionCall, Assignment, String)):
+            return False
+        if isinstance(child, BinOp) and child.operation in (BinOp.DIVIDE, BinOp.MODULO):
+            return False
+        if isinstance(child, Identifier) and child.name in changed:
+            return False
+    return True
@@ -1,20 +1,129 @@
+import itertools
+import json
+import os
+
 import click as click
 
-from lexer import parse, read_grammar, to_ast
-from llvm_backend import to_llvm
+from inliner import inline_calls, INLINE_LIMIT
+from interpreter import run as interpret, InterpreterError
+from lexer import load_grammar, parse_source, to_ast, SourceSyntaxError, iter_token_lines, iter_token_records
+from loop_invariants import hoist_invariants
+from preprocessor import preprocess, PreprocessError
+from tree import iter_ast_lines, iter_ast_records, Wrap
+from type_inference import TypeInferenceError
 
-with open('C_grammar', 'r') as f:
-    g = read_grammar(f.read())
+# Relative to where we run from, like it always was.
+GRAMMAR_PATH = 'C_grammar'
 
 
 # @click.Parameter()   # nice to get the docs on signature/parameters that click.argument does not give easily.
 @click.command()
 @click.argument('source-file', type=click.File(), required=True)
-def compile(source_file):
-    token_list, remainder = parse(g, source_file.read())
-    assert remainder.strip() == '', 'Failed to parse!'
+@click.option('--emit', type=click.Choice(['tokens', 'ast', 'ir']), default='ir',
+              help='What to print: the parse tree, the ast or LLVM IR. Only `ir` needs llvmlite.')
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='Where to write the output. Defaults to stdout.')
+@click.option('--max-parse-steps', type=int, default=None,
+              help='Give up parsing after that many steps (for each top-level statement when emitting IR or the ast). '
+                   'Defaults to a budget based on the source size, 0 for no limit.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=None,
+              help='Keep the IR of each function there, and reuse it next time if the function did not change.')
+@click.option('--run', is_flag=True,
+              help='Run the program with the interpreter instead of printing IR. The exit code is what main returns.')
+@click.option('--instrument', type=click.Path(dir_okay=False), default=None, metavar='COUNTS_FILE',
+              help='Make the program count how many times each block of code runs, and write the counts to '
+                   'COUNTS_FILE when it exits. What they are about goes to COUNTS_FILE.json, see profile_report.py.')
+@click.option('--inline-limit', type=int, default=INLINE_LIMIT, show_default=True,
+              help='Inline calls to the functions with at most that many nodes in their body (see inliner.py). 0 to '
+                   'not inline anything.')
+@click.option('--hoist/--no-hoist', default=True, show_default=True,
+              help='Compute what does not change in a loop once, before it (see loop_invariants.py).')
+@click.option('--unroll-count', type=int, default=0, show_default=True,
+              help='How many times to unroll loops, when the IR is optimized. 0 to let LLVM decide.')
+@click.option('--json-lines', is_flag=True,
+              help='With `--emit tokens` or `--emit ast`: one JSON object per node (its depth, its type and its '
+                   'values), one per line.')
+def compile(source_file, emit, output, max_parse_steps, cache_dir, run, instrument, inline_limit, hoist, unroll_count,
+            json_lines):
+    if instrument is not None and (emit != 'ir' or run or cache_dir is not None):
+        raise click.UsageError('--instrument only works when emitting IR, without --run or --cache-dir.')
+    # Loaded here and not when importing this file: `--help` does not need it.
+    g = load_grammar(GRAMMAR_PATH)
+    if emit == 'ir' and not run and cache_dir is None:
+        # The usual case: no need for the whole program at once, we write each function as soon as it is parsed.
+        from llvm_backend import CodegenError
+        from streaming import compile_stream
+        try:
+            for piece in compile_stream(g, source_file, max_steps=max_parse_steps, instrument=instrument,
+                                        inline_limit=inline_limit, hoist=hoist, unroll_count=unroll_count):
+                output.write(piece)
+        except (PreprocessError, SourceSyntaxError, CodegenError, TypeInferenceError) as e:
+            raise click.ClickException(f'{source_file.name}: {e}')
+        if instrument is not None:
+            from llvm_backend import instrumentation_map
+            with open(instrument + '.json', 'w') as f:
+                # How we changed the ast: the nodes of the counters are in that one, see profile_report.py.
+                json.dump({'source': source_file.name, 'inline_limit': inline_limit, 'hoist': hoist,
+                           'counters': instrumentation_map()}, f, indent=2)
+        return
+
+    if emit in ('ast', 'tokens') and not run:
+        # Like IR: written as it's parsed. We never have the ast of the whole program, or the whole dump, in memory.
+        # The parse tree of the program nests each statement in the `Block` of the previous one: we leave that out,
+        # the statements are all right below `Wrap` like in the ast.
+        from streaming import iter_statements, iter_statement_tokens
+        if emit == 'ast':
+            dump = iter_ast_records if json_lines else iter_ast_lines
+            statements = iter_statements(g, source_file, max_steps=max_parse_steps)
+            root = Wrap([])
+        else:
+            dump = iter_token_records if json_lines else iter_token_lines
+            statements = iter_statement_tokens(g, source_file, max_steps=max_parse_steps)
+            root = ['Wrap']
+        try:
+            write_dump(itertools.chain(dump(root), itertools.chain.from_iterable(
+                dump(statement, depth=1) for statement in statements)), output, json_lines)
+        except (PreprocessError, SourceSyntaxError) as e:
+            raise click.ClickException(f'{source_file.name}: {e}')
+        return
+
+    try:
+        source, source_map = preprocess(source_file.read())
+        token_list = parse_source(g, source, max_steps=max_parse_steps, source_map=source_map)
+    except (PreprocessError, SourceSyntaxError) as e:
+        raise click.ClickException(f'{source_file.name}: {e}')
+
     ast = to_ast(token_list)
-    print(to_llvm(ast))
+
+    if run:
+        try:
+            result = interpret(ast)
+        except InterpreterError as e:
+            raise click.ClickException(str(e))
+        # Like a real process: only the lowest byte of main's return value makes it to the exit code.
+        raise SystemExit(result & 0xFF)
+
+    # Only imported when needed: llvmlite is slow to import.
+    from incremental_build import cache_path, compile_incremental, load_cache, save_cache
+    from llvm_backend import CodegenError
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, source_file.name)
+    cache = load_cache(path)
+    ast.statements = list(inline_calls(ast.statements, inline_limit))
+    if hoist:
+        ast.statements = list(hoist_invariants(ast.statements))
+    try:
+        ir_code, _ = compile_incremental(ast, cache, unroll_count=unroll_count)
+    except (CodegenError, TypeInferenceError) as e:
+        raise click.ClickException(f'{source_file.name}: {e}')
+    save_cache(path, cache)
+    print(ir_code, file=output)
+
+
+def write_dump(lines, output, json_lines: bool):
+    """One line at a time: the dump of a big program can be big."""
+    for line in lines:
+        output.write((json.dumps(line) if json_lines else line) + '\n')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+"""Everything that happens to the source text before the parser sees it.
+
+For now this means removing comments. The parser used to look for a comment before every single atom, which was slow
+and did not work for a comment on the last line of a file. Here we do it once, in a single pass over the text.
+
+We keep a map from the processed text back to the original text so errors can still point at the right line.
+"""
+import bisect
+import re
+from typing import List, Tuple
+
+# What we need to stop at when scanning the source: comment starts, and quotes (`"// not a comment"`).
+_INTERESTING = re.compile(r'//|/\*|"|\'')
+
+
+class PreprocessError(Exception):
+
+    def __init__(self, message: str, offset: int):
+        self.offset = offset
+        super().__init__(message)
+
+
+class SourceMap:
+    """Map offsets in the processed text to offsets, lines and columns in the original text.
+
+    The processed text is the original text with some pieces cut out. So it's a sequence of chunks that were copied
+    verbatim: for each chunk we only store where it starts in both texts. Inside a chunk the offsets move together.
+    """
+
+    def __init__(self, original: str, processed_starts: List[int], original_starts: List[int]):
+        self.original = original
+        self.processed_starts = processed_starts
+        self.original_starts = original_starts
+        # Computed when we first need it: most of the time nobody asks for a line number.
+        self._line_starts = None
+
+    def original_offset(self, offset: int) -> int:
+        i = bisect.bisect_right(self.processed_starts, offset) - 1
+        if i < 0:
+            return offset
+        return self.original_starts[i] + offset - self.processed_starts[i]
+
+    def line_col(self, offset: int) -> Tuple[int, int]:
+        """1-based line and column in the original text for an offset in the processed text."""
+        if self._line_starts is None:
+            self._line_starts = [0] + [m.end() for m in re.finditer('\n', self.original)]
+        original_offset = self.original_offset(offset)
+        line = bisect.bisect_right(self._line_starts, original_offset)
+        return line, original_offset - self._line_starts[line - 1] + 1
+
+
+def preprocess(text: str) -> Tuple[str, SourceMap]:
+    """Remove `//` and `/* */` comments.
+
+    A line comment disappears but its line break stays. A block comment is replaced by a single space (like C does),
+    so `int/**/a` does not become `inta`.
+    """
+    chunks = []
+    processed_starts = []
+    original_starts = []
+    processed_length = 0
+
+    def keep(chunk, original_start):
+        nonlocal processed_length
+        if chunk:
+            chunks.append(chunk)
+            processed_starts.append(processed_length)
+            original_starts.append(original_start)
+            processed_length += len(chunk)
+
+    # `start` is where the text we have not copied yet begins, `position` is where we resume scanning.
+    start = position = 0
+    while True:
+        match = _INTERESTING.search(text, position)
+        if match is None:
+            break
+        token = match.group()
+
+        if token in {'"', "'"}:
+            # Skip over literals. An unterminated one is the parser's problem, it will fail on it anyway.
+            closing = text.find(token, match.end())
+            position = len(text) if closing == -1 else closing + 1
+            continue
+
+        keep(text[start:match.start()], start)
+        if token == '//':
+            line_break = text.find('\n', match.end())
+            start = position = len(text) if line_break == -1 else line_break
+        else:
+            closing = text.find('*/', match.end())
+            if closing == -1:
+                raise PreprocessError(f'Unterminated comment starting at offset {match.start()}', match.start())
+            keep(' ', match.start())
+            start = position = closing + 2
+
+    keep(text[start:], start)
+    return ''.join(chunks), SourceMap(text, processed_starts, original_starts)
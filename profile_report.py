@@ -0,0 +1,77 @@
+"""Where an instrumented program spends its time: how many times each block of code ran, most run first.
+
+    python main.py --instrument counts.txt program.c | lli
+    python profile_report.py counts.txt
+
+The counts are in `counts.txt`, what they are about in `counts.txt.json` (see `llvm_backend.instrumentation_map`). We
+parse the source again, and inline calls and hoist loop invariants like main.py did, to find the nodes the blocks belong
+to.
+"""
+import json
+from typing import Dict, List, Tuple
+
+import click
+
+from inliner import inline_calls
+from lexer import load_grammar, parse_source, to_ast
+from loop_invariants import hoist_invariants
+from preprocessor import preprocess
+from tree import ast_to_str, AstNode, Function, ForLoop, If
+
+GRAMMAR_PATH = 'C_grammar'
+
+
+def one_line(node: AstNode) -> str:
+    return ' '.join(ast_to_str(node).split())
+
+
+def describe(node: AstNode) -> str:
+    if isinstance(node, Function):
+        return f'{node.return_type} {node.name.name}()'
+    if isinstance(node, If):
+        return 'if ' + one_line(node.condition)
+    if isinstance(node, ForLoop):
+        return 'for ' + one_line(node.for_condition)
+    return str(node)
+
+
+def profile(counters: List[dict], counts: List[int], functions: Dict[str, Function]) \
+        -> List[Tuple[int, str, str, str]]:
+    """(count, function, block, what the block belongs to) for each counter, most run first."""
+    if len(counts) != len(counters):
+        raise click.ClickException(f'{len(counts)} counts for {len(counters)} blocks. Did the program exit normally? '
+                                   f'Was it compiled again since?')
+    nodes = {}
+    rows = []
+    for counter, count in zip(counters, counts):
+        name = counter['function']
+        if name not in nodes:
+            nodes[name] = list(functions[name].walk())
+        rows.append((count, name, counter['block'], describe(nodes[name][counter['node']])))
+    # Stable: same count, program order.
+    return sorted(rows, key=lambda row: -row[0])
+
+
+@click.command()
+@click.argument('counts-file', type=click.File(), required=True)
+def profile_report(counts_file):
+    with open(counts_file.name + '.json', 'r') as f:
+        counters_map = json.load(f)
+    counts = [int(line) for line in counts_file]
+
+    with open(counters_map['source'], 'r') as f:
+        source, source_map = preprocess(f.read())
+    ast = to_ast(parse_source(load_grammar(GRAMMAR_PATH), source, source_map=source_map))
+    ast.statements = list(inline_calls(ast.statements, counters_map.get('inline_limit', 0)))
+    if counters_map.get('hoist', False):
+        ast.statements = list(hoist_invariants(ast.statements))
+    functions = {statement.name.name: statement for statement in ast.statements if isinstance(statement, Function)}
+
+    rows = profile(counters_map['counters'], counts, functions)
+    widths = [max([len(str(row[column])) for row in rows] + [0]) for column in range(3)]
+    for count, function, block, description in rows:
+        click.echo(f'{count:>{widths[0]}}  {function:<{widths[1]}}  {block:<{widths[2]}}  {description}')
+
+
+if __name__ == '__main__':
+    profile_report()
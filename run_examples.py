@@ -0,0 +1,137 @@
+"""Compile the examples with our compiler and with clang, run both with lli, compare the exit codes.
+
+Like `test_examples.sh`, but the files are handled in parallel and the clang results are cached: they only change
+when the source changes.
+
+    python run_examples.py examples/*/*.c
+"""
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import subprocess
+import time
+
+import click
+
+from inliner import INLINE_LIMIT
+from lexer import read_grammar
+from streaming import compile_stream
+
+DEFAULT_REFERENCE_CACHE = os.path.join('examples', 'reference_exit_codes.json')
+
+# Loaded once per worker process, see `get_grammar`.
+_grammar = None
+
+
+def get_grammar(grammar_path):
+    global _grammar
+    if _grammar is None:
+        with open(grammar_path, 'r') as f:
+            _grammar = read_grammar(f.read())
+    return _grammar
+
+
+def source_hash(source: str) -> str:
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def run_ir(ir_code: str) -> int:
+    return subprocess.run(['lli'], input=ir_code.encode(), stdout=subprocess.DEVNULL).returncode
+
+
+def reference_exit_code(path: str) -> int:
+    clang = subprocess.run(['clang', '-emit-llvm', '-S', path, '-o', '-'], stdout=subprocess.PIPE, check=True)
+    return run_ir(clang.stdout.decode())
+
+
+def check_example(path: str, grammar_path: str, expected: int = None, inline_limit: int = INLINE_LIMIT,
+                  hoist: bool = True) -> dict:
+    """Runs in a worker process. `expected` is the cached clang result, if we have one.
+
+    We compile the way main.py does: it's what we ship that we want to check.
+    """
+    result = {'path': path, 'expected': expected, 'actual': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        with open(path, 'r') as f:
+            source = f.read()
+        result['hash'] = source_hash(source)
+
+        ir_code = ''.join(compile_stream(get_grammar(grammar_path), io.StringIO(source), inline_limit=inline_limit,
+                                         hoist=hoist))
+        compile_done = time.perf_counter()
+        result['compile_time'] = compile_done - start
+
+        result['actual'] = run_ir(ir_code)
+        run_done = time.perf_counter()
+        result['run_time'] = run_done - compile_done
+
+        if expected is None:
+            result['expected'] = reference_exit_code(path)
+            result['reference_time'] = time.perf_counter() - run_done
+    except Exception as e:
+        # Whatever goes wrong, it's a failure for this file only.
+        result['error'] = f'{e.__class__.__name__}: {e}'
+    return result
+
+
+def load_reference_cache(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def format_result(result: dict) -> str:
+    ok = result['error'] is None and result['expected'] == result['actual']
+    timings = ' '.join(f'{step} {result[step + "_time"] * 1000:.1f}ms' for step in ['compile', 'run', 'reference']
+                       if step + '_time' in result)
+    details = result['error'] if result['error'] is not None else \
+        f'expected {result["expected"]}, got {result["actual"]}'
+    return f'{"OK  " if ok else "FAIL"}  {result["path"]}  {timings}  ({details})'
+
+
+@click.command()
+@click.argument('source-files', nargs=-1, type=click.Path(exists=True, dir_okay=False), required=True)
+@click.option('--jobs', '-j', type=int, default=None, help='Number of worker processes. Defaults to the CPU count.')
+@click.option('--reference-cache', type=click.Path(dir_okay=False), default=DEFAULT_REFERENCE_CACHE,
+              help='Where clang exit codes are kept, by source hash.')
+@click.option('--grammar', 'grammar_path', type=click.Path(exists=True, dir_okay=False), default='C_grammar')
+@click.option('--inline-limit', type=int, default=INLINE_LIMIT, show_default=True, help='Like for main.py.')
+@click.option('--hoist/--no-hoist', default=True, show_default=True, help='Like for main.py.')
+def run_examples(source_files, jobs, reference_cache, grammar_path, inline_limit, hoist):
+    start = time.perf_counter()
+    cache = load_reference_cache(reference_cache)
+
+    def cached_exit_code(path):
+        with open(path, 'r') as f:
+            return cache.get(source_hash(f.read()))
+
+    failures = 0
+    cache_size = len(cache)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(check_example, path, grammar_path, cached_exit_code(path), inline_limit, hoist)
+                   for path in source_files]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            click.echo(format_result(result))
+            if result['error'] is not None or result['expected'] != result['actual']:
+                failures += 1
+            if result['expected'] is not None and 'hash' in result:
+                cache[result['hash']] = result['expected']
+
+    if len(cache) != cache_size:
+        with open(reference_cache, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+
+    passed = len(source_files) - failures
+    click.echo(f'{passed} passed, {failures} failed in {time.perf_counter() - start:.2f}s')
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    run_examples()
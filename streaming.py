@@ -0,0 +1,156 @@
+r"""Parse and compile a program one top-level statement at a time, reading the source as we go.
+
+A program is a sequence of top-level statements (`Block => Statement \s Block | Statement` in the grammar). We read a
+chunk of the source, parse as many statements as we can from it, hand them out and forget their text. So we hold about
+one chunk and one statement at a time, whatever the size of the source:
+
+    with open('huge.c') as f:
+        for piece in compile_stream(g, f):
+            sys.stdout.write(piece)
+
+The tricky part is the end of the chunk: `return x` followed by the end of the chunk could become `return xyz;` with
+more text. A statement is only accepted if the parser never looked at the last `LOOKAHEAD_MARGIN` characters of what we
+have read, so more text could not have changed it. Otherwise we read more and parse it again.
+"""
+from typing import Iterator, TextIO, Union
+
+from inliner import inline_calls
+from lexer import parse_atom, to_ast, default_max_steps, ParseContext, ParseError, ParseLimitExceeded, \
+    SourceSyntaxError
+from loop_invariants import hoist_invariants
+from preprocessor import preprocess, PreprocessError
+from tree import AstNode
+
+CHUNK_SIZE = 16384
+# Longer than any keyword or operator, plus a bit for regular expressions peeking after what they match.
+LOOKAHEAD_MARGIN = 16
+
+
+class _Position:
+    """Where the text we hold starts in the whole source, to report errors at the right place."""
+
+    def __init__(self):
+        self.offset = 0
+        # Lines before, and characters before on its line.
+        self.lines = 0
+        self.column = 0
+
+    def advance(self, consumed: str):
+        self.offset += len(consumed)
+        newlines = consumed.count('\n')
+        if newlines:
+            self.lines += newlines
+            self.column = len(consumed) - consumed.rindex('\n') - 1
+        else:
+            self.column += len(consumed)
+
+    def shift(self, error: SourceSyntaxError) -> SourceSyntaxError:
+        column = error.column + self.column if error.line == 1 else error.column
+        return SourceSyntaxError(error.line + self.lines, column, error.expected, reason=error.reason)
+
+
+def iter_statements(grammar, source: TextIO, chunk_size: int = CHUNK_SIZE, max_steps: Union[int, None] = None) \
+        -> Iterator[AstNode]:
+    """The top-level statements of the program, as ast nodes. Same ones as `to_ast(parse_source(...)).statements`.
+
+    Raises a SourceSyntaxError (at the position in the whole source) when we get to an invalid statement.
+
+    :param max_steps: like for `lexer.parse_source`, but for each statement.
+    """
+    for tokens in iter_statement_tokens(grammar, source, chunk_size=chunk_size, max_steps=max_steps):
+        statements = to_ast(tokens)
+        yield from statements if isinstance(statements, list) else [statements]
+
+
+def iter_statement_tokens(grammar, source: TextIO, chunk_size: int = CHUNK_SIZE,
+                          max_steps: Union[int, None] = None) -> Iterator[list]:
+    """The parse tree of each top-level statement (a `Statement` rule), see `iter_statements`."""
+    buffer = ''
+    at_eof = False
+    position = _Position()
+    # Where the parser failed furthest, from where we cut the text and what it expected there. A failed attempt in a
+    # statement can go further than the statement (`int (a) {`), it can be the error to report after we cut.
+    furthest_failure = None
+    while True:
+        # Read at least as much as we already have: a statement that does not fit is parsed a logarithmic number of
+        # times, not once per chunk.
+        chunk = '' if at_eof else source.read(max(chunk_size, len(buffer)))
+        at_eof = at_eof or not chunk
+        buffer += chunk
+
+        try:
+            text, source_map = preprocess(buffer)
+        except PreprocessError as e:
+            if at_eof:
+                raise PreprocessError(f'Unterminated comment starting at offset {position.offset + e.offset}',
+                                      position.offset + e.offset) from None
+            # The end of the comment is probably in the next chunk.
+            continue
+
+        # One context for all the statements, like a full parse: errors are reported the same way.
+        context = ParseContext(grammar)
+        if furthest_failure is not None:
+            context.furthest_remaining = len(text) - furthest_failure[0]
+            context.expected = furthest_failure[1]
+        start = 0
+        while text[start:].strip():
+            context.steps = 0
+            context.max_steps = default_max_steps(text) if max_steps is None else max_steps or None
+            context.nearest_end = None
+            try:
+                tokens, remainder = parse_atom(grammar, 'Statement', text[start:], context=context)
+            except ParseLimitExceeded as e:
+                raise position.shift(context.syntax_error(text, str(e), len(text) - start, source_map)) from None
+            except ParseError:
+                if at_eof or context.nearest_end >= LOOKAHEAD_MARGIN:
+                    raise position.shift(context.syntax_error(text, 'invalid syntax', len(text) - start, source_map)) \
+                        from None
+                break
+            if not at_eof and context.nearest_end < LOOKAHEAD_MARGIN:
+                break
+
+            # Top-level statements need whitespace in between, see the grammar.
+            if remainder.strip():
+                try:
+                    _, remainder = parse_atom(grammar, '\\s', remainder, context=context)
+                except ParseError:
+                    raise position.shift(context.syntax_error(text, 'invalid syntax', len(remainder), source_map)) \
+                        from None
+            end = len(text) - len(remainder.lstrip())
+            if end == len(text) and not at_eof:
+                # The next statement might still be separated from this one by nothing at all.
+                break
+
+            yield tokens
+            start = end
+
+        if at_eof:
+            return
+        # What we parsed is gone for good. We cut where the next statement starts (after comments, not in one), so the
+        # text we keep starts like the rest of `text` does.
+        furthest_failure = None
+        furthest = len(text) - context.furthest_remaining if context.furthest_remaining is not None else -1
+        if start <= furthest <= len(text) - LOOKAHEAD_MARGIN:
+            furthest_failure = (furthest - start, context.expected)
+        consumed = source_map.original_offset(start) if start else 0
+        position.advance(buffer[:consumed])
+        buffer = buffer[consumed:]
+
+
+def compile_stream(grammar, source: TextIO, chunk_size: int = CHUNK_SIZE, max_steps: Union[int, None] = None,
+                   instrument: Union[str, None] = None, inline_limit: int = 0, hoist: bool = False,
+                   unroll_count: int = 0) -> Iterator[str]:
+    """The IR of the program, in pieces, each function as soon as it is parsed. Joined, it's `str(to_llvm(ast))`.
+
+    :param instrument: see `iter_llvm`.
+    :param inline_limit: see `inliner`. Inlining changes the IR: 0, the default, does not inline anything.
+    :param hoist: compute the loop invariants before the loops, see `loop_invariants`. Off by default, same reason.
+    :param unroll_count: see `iter_llvm`.
+    """
+    # Only imported when needed: llvmlite is slow to import.
+    from llvm_backend import iter_llvm
+    statements = iter_statements(grammar, source, chunk_size=chunk_size, max_steps=max_steps)
+    statements = inline_calls(statements, inline_limit)
+    if hoist:
+        statements = hoist_invariants(statements)
+    return iter_llvm(statements, instrument=instrument, unroll_count=unroll_count)
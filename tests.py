@@ -3,14 +3,16 @@ I wrote these tests as I was programming to help avoid regressions.
 
 Most of them are 'weak tests' that don't check correctness (just some level of non-brokenness).
 """
+import io
 from pprint import pprint
 
+import pytest
 from llvmlite import ir
 
 from lexer import read_grammar, parse, to_ast
 
 from tree import ast_to_str, Function, BinOp, UnOp
-from llvm_backend import function_to_llvm, to_llvm
+from llvm_backend import function_to_llvm, to_llvm, write_llvm, constant, new_module, iter_llvm, CodegenError
 
 simple_assign = 'int valid_identifier = 42;'
 invalid_identifier = 'int 911notvalid = 42;'
@@ -213,10 +215,10 @@ def test_function_node_to_llvm():
     module = ir.Module('test')
     ir_code = function_to_llvm(func_node, module)
 
-    expected_ir_code = """define i64 @"fibo"() 
+    expected_ir_code = """define i32 @"fibo"() 
 {
 entry:
-  ret i64 42
+  ret i32 42
 }"""
     assert expected_ir_code.strip() in str(ir_code)
 
@@ -227,10 +229,10 @@ def test_simple_module_function_to_llvm():
 
     ir_code = to_llvm(my_ast)
 
-    expected_ir_code = """define i64 @"fibo"() 
+    expected_ir_code = """define i32 @"fibo"() 
 {
 entry:
-  ret i64 42
+  ret i32 42
 }"""
     assert expected_ir_code.strip() in str(ir_code)
 
@@ -241,10 +243,10 @@ def test_integration_temp():
     }"""
     ast = get_ast(code)
     ir_code = to_llvm(ast)
-    expected_ir_code = """define i64 @"main"() 
+    expected_ir_code = """define i32 @"main"() 
 {
 entry:
-  ret i64 3
+  ret i32 3
 }"""
     assert expected_ir_code.strip() in str(ir_code)
 
@@ -288,3 +290,144 @@ def test_parse_for_with_without_braces():
 
     ast_2 = get_ast(src_2)
     assert ast_to_str(ast_2) == ast_to_str(ast)
+
+
+def test_write_llvm():
+    src = """int add(int a, int b) {
+    return a + b;
+}
+int main() {
+    return add(1, 2);
+}"""
+    output = io.StringIO()
+    write_llvm(get_ast(src), output)
+    assert output.getvalue() == str(to_llvm(get_ast(src))) + '\n'
+
+
+def test_string_literals_to_llvm():
+    src = """int hello() {
+    return puts("hello");
+}
+int main() {
+    printf("%s\\n", "hello");
+    return hello();
+}"""
+    output = io.StringIO()
+    write_llvm(get_ast(src), output)
+    ir_code = output.getvalue()
+    assert ir_code == str(to_llvm(get_ast(src))) + '\n'
+    # One global per string, however many times it's used.
+    assert ir_code.count('private constant [6 x i8] c"hello\\00"') == 1
+    assert 'private constant [4 x i8] c"%s\\0a\\00"' in ir_code
+    assert ir_code.count('getelementptr inbounds [6 x i8]') == 2
+    # Functions we know nothing about are declared for the linker.
+    assert 'declare i32 @"puts"(...)' in ir_code
+    assert 'declare i32 @"printf"(...)' in ir_code
+
+
+def test_constants_are_interned():
+    new_module()
+    assert constant('int', 1) is constant('int', 1)
+    assert constant('int', 1) is not constant('char', 1)
+    # Big constants are not kept around.
+    assert constant('int', 1 << 20) is not constant('int', 1 << 20)
+
+    ir_code = str(to_llvm(get_ast("""int main() {
+    int a = 1 + 1;
+    return a * 1 + 'a';
+}""")))
+    assert 'add i32 1, 1' in ir_code
+    assert 'add i32 %".5", 97' in ir_code
+
+
+def test_condition_evaluated_once():
+    ir_code = str(to_llvm(get_ast("""int next() {
+    return 1;
+}
+int main() {
+    int a = 0;
+    if (next()) a = 1;
+    for (a = 0; a = a - 1; a = a) 1;
+    return a;
+}""")))
+    assert ir_code.count('call i32 @"next"()') == 1
+    assert ir_code.count('sub i32') == 1
+
+
+def test_if_chain_to_switch():
+    src = """int f(int x) {
+    if (x == 1) return 10;
+    else if (2 == x) return 20;
+    else if (x == 'a') return 30;
+    else return 40;
+}"""
+    ir_code = str(to_llvm(get_ast(src)))
+    assert 'switch i32 %".1", label %"entry.default" [i32 1, label %"entry.case" i32 2, label %"entry.case.1" ' \
+           'i32 97, label %"entry.case.2"]' in ir_code
+    assert 'icmp' not in ir_code
+
+    # Two variables, or not enough cases: we leave it alone.
+    for src in ["int f(int x, int y) { if (x == 1) return 1; else if (y == 2) return 2; else if (x == 3) return 3; }",
+                "int f(int x) { if (x == 1) return 1; else if (x == 2) return 2; }"]:
+        assert 'switch' not in str(to_llvm(get_ast(src)))
+
+
+def test_tail_calls():
+    ir_code = str(to_llvm(get_ast("""int other(int a, int b) {
+    return a;
+}
+char narrow(int a) {
+    return a;
+}
+int f(int a, int b) {
+    if (a == 0) return other(b, a);
+    if (a == 1) return narrow(b);
+    return f(b, a - 1);
+}""")))
+    assert 'tail call i32 @"other"' in ir_code
+    assert 'tail call i8 @"narrow"' in ir_code
+    # Calling itself is a loop. Both args are read before they are changed.
+    assert 'call i32 @"f"' not in ir_code
+    assert 'br label %"tailrecurse"' in ir_code
+    f_code = ir_code[ir_code.index('define i32 @"f"'):]
+    loop = f_code[f_code.rindex('load i32, i32* %"b"'):]
+    assert loop.index('load i32, i32* %"a"') < loop.index('store')
+
+
+def test_allocas_in_entry_block():
+    ir_code = str(to_llvm(get_ast("""int main() {
+    int i;
+    for (i = 0; i < 10; i = i + 1) {
+        int a = i;
+    }
+    return i;
+}""")))
+    entry = ir_code[ir_code.index('entry:'):ir_code.index('entry.forcondition:')]
+    assert entry.count('alloca') == 2
+
+
+def test_loop_metadata():
+    src = """int main() {
+    int i;
+    int j;
+    for (i = 0; i < 10; i = i + 1) j = i;
+    for (i = 0; i < 10; i = i + 1) j = j + i;
+    return j;
+}"""
+    ir_code = str(to_llvm(get_ast(src)))
+    # On the way back to the condition, each loop its own.
+    assert 'br label %"entry.forcondition", !llvm.loop !2' in ir_code
+    assert 'br label %"entry.endfor.forcondition", !llvm.loop !5' in ir_code
+    assert '!2 = distinct !{ !2, !0, !1 }' in ir_code
+    assert '!0 = !{ !"llvm.loop.vectorize.enable", i1 1 }' in ir_code
+    assert '!1 = !{ !"llvm.loop.unroll.enable" }' in ir_code
+
+    ir_code = ''.join(iter_llvm(get_ast(src).statements, unroll_count=4))
+    assert '!1 = !{ !"llvm.loop.unroll.count", i32 4 }' in ir_code
+
+
+def test_call_before_definition():
+    with pytest.raises(CodegenError, match='f is called before it is defined'):
+        to_llvm(get_ast("int main() {\n    return f(2);\n}\nint f(int a) {\n    return a;\n}"))
+    with pytest.raises(CodegenError, match='f is defined twice'):
+        to_llvm(get_ast("int f() {\n    return 1;\n}\nint f() {\n    return 2;\n}"))
@@ -0,0 +1,83 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+import llvm_backend
+from async_compiler import AsyncCompiler, CompileError, compile_source
+
+src = """int square(int x) { return x * x; }
+int main() { return square(3); }"""
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+@pytest.fixture(scope='module')
+def compiler():
+    compiler = AsyncCompiler(max_workers=2)
+    yield compiler
+    compiler.close()
+
+
+def test_compile_source_fresh_state():
+    state = llvm_backend.llvm_converter_state
+    state.functions['leftover'] = None
+    assert compile_source(src) == compile_source(src)
+    assert 'leftover' not in compile_source(src)
+    # What was there before is back.
+    assert llvm_backend.llvm_converter_state is state
+
+
+def test_compile(compiler):
+    assert run(compiler.compile(src)) == compile_source(src)
+    with pytest.raises(CompileError) as e:
+        run(compiler.compile('int main( { return 1; }'))
+    assert 'SourceSyntaxError' in str(e.value)
+
+
+def test_compile_many(compiler):
+    jobs = [(f'f{i}.c', src.replace('3', str(i))) for i in range(8)] + [('bad.c', 'int main(')]
+
+    async def collect():
+        return [result async for result in compiler.compile_many(jobs)]
+
+    results = {result['name']: result for result in run(collect())}
+    assert set(results) == {name for name, _ in jobs}
+    assert results['f5.c']['ir'] == compile_source(jobs[5][1])
+    assert results['f5.c']['error'] is None
+    assert results['bad.c']['ir'] is None and 'SourceSyntaxError' in results['bad.c']['error']
+
+
+def test_compile_many_timeout(compiler):
+    # Long enough to take more than a millisecond.
+    big = '\n'.join(f'int f{i}(int n) {{ return n * {i}; }}' for i in range(300))
+
+    async def collect():
+        return [result async for result in compiler.compile_many([('big.c', big), ('small.c', src)], timeout=0.001)]
+
+    results = {result['name']: result for result in run(collect())}
+    assert results['big.c']['error'].startswith('TimeoutError')
+
+
+def test_compile_many_stop_early(compiler):
+    jobs = [(f'f{i}.c', src) for i in range(20)]
+
+    async def first():
+        async for result in compiler.compile_many(jobs):
+            return result
+
+    assert run(first())['error'] is None
+    # The ones that were left were cancelled, the compiler still works.
+    assert run(compiler.compile(src)) == compile_source(src)
+
+
+def test_broken_pool():
+    pool = concurrent.futures.ProcessPoolExecutor(1)
+    pool.shutdown()
+    compiler = AsyncCompiler(pool, concurrency=1)
+    # The first failure must not keep the only slot: the second would wait for it forever.
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            run(asyncio.wait_for(compiler.compile(src), 5))
@@ -0,0 +1,108 @@
+import pytest
+
+from incremental import parse_incremental, reparse
+from lexer import read_grammar, parse_source, to_ast, SourceSyntaxError
+from preprocessor import preprocess
+from tree import AstNode
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+source = """int add(int a, int b) {
+    return a + b;
+}
+
+// Comments belong to the function before them.
+int twice(int a) {
+    return add(a, a);
+}
+
+int main() {
+    int a = 2;
+    return twice(a);
+}"""
+
+
+def dump(node):
+    """A comparable version of an ast. Nodes don't implement __eq__."""
+    if isinstance(node, AstNode):
+        return node.__class__.__name__, tuple((k, dump(v)) for k, v in sorted(vars(node).items()))
+    if isinstance(node, (list, tuple)):
+        return tuple(dump(n) for n in node)
+    return node
+
+
+def full_parse(text):
+    text, source_map = preprocess(text)
+    return to_ast(parse_source(g, text, source_map=source_map))
+
+
+def edit(result, old, new, occurrence=0):
+    offset = -1
+    for _ in range(occurrence + 1):
+        offset = result.text.index(old, offset + 1)
+    return reparse(g, result, offset, len(old), new)
+
+
+def test_parse_incremental_matches_full_parse():
+    result = parse_incremental(g, source)
+    assert dump(result.ast) == dump(full_parse(source))
+    assert [s.start for s in result.segments] == [0, source.index('int twice'), source.index('int main')]
+    assert result.segments[-1].end == len(source)
+
+
+def test_reparse_reuses_untouched_statements():
+    result = parse_incremental(g, source)
+    add, twice, main = [s.statements for s in result.segments]
+
+    new_result = edit(result, 'return add(a, a);', 'return add(a, add(a, 1));')
+    assert dump(new_result.ast) == dump(full_parse(new_result.text))
+    # Same objects: they were not parsed again.
+    assert new_result.segments[0].statements is add
+    assert new_result.segments[2].statements is main
+    assert new_result.segments[1].statements is not twice
+    assert new_result.segments[2].start == result.segments[2].start + len('add(a, 1)') - len('a')
+
+
+def test_reparse_adds_and_removes_statements():
+    result = parse_incremental(g, source)
+
+    result = edit(result, '\nint main', '\nint three() { return 3; }\nint main')
+    assert len(result.segments) == 4
+    assert dump(result.ast) == dump(full_parse(result.text))
+
+    result = edit(result, 'int three() { return 3; }\n', '')
+    assert len(result.segments) == 3
+    assert dump(result.ast) == dump(full_parse(result.text))
+
+
+def test_reparse_across_statements():
+    # `a` then `(1);` are two statements, but `a(1);` is a single one.
+    result = parse_incremental(g, 'a;\n(1);')
+    assert len(result.segments) == 2
+    result = edit(result, ';', '')
+    assert dump(result.ast) == dump(full_parse('a\n(1);'))
+    assert len(result.segments) == 1
+
+    # Opening a comment that swallows the next statements.
+    result = parse_incremental(g, 'int a = 1;\nint b = 2; // */\nint c = 3;')
+    result = reparse(g, result, 0, 0, '/*')
+    assert dump(result.ast) == dump(full_parse('/*int a = 1;\nint b = 2; // */\nint c = 3;'))
+    assert len(result.segments) == 1
+
+
+def test_reparse_invalid_edit():
+    result = parse_incremental(g, source)
+    with pytest.raises(SourceSyntaxError) as e:
+        edit(result, 'a + b', 'a + ')
+    assert e.value.line == 2
+
+
+def test_reparse_keyword_as_name():
+    # `return` is not a variable: `int return` is not a declaration, `return }` is an error.
+    result = parse_incremental(g, 'int main() {\n    return -4/-2;\n}')
+    with pytest.raises(SourceSyntaxError):
+        reparse(g, result, 24, 6, '}')
+    # Not a declaration of `return`: `int`, then a return.
+    main = to_ast(parse_source(g, 'int main() {\nint return 3;\n}')).statements[0]
+    assert [node.__class__.__name__ for node in main.body.statements] == ['Identifier', 'Return']
@@ -0,0 +1,135 @@
+from lexer import read_grammar, parse_source, to_ast
+from llvm_backend import to_llvm
+from incremental_build import compile_incremental, load_cache, save_cache
+from inliner import inline_calls
+from tree import Wrap
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+source = """int add(int a, int b) {
+    return a + b;
+}
+int twice(int a) {
+    return add(a, a);
+}
+int three() {
+    return 3;
+}
+int main() {
+    return twice(three());
+}"""
+
+
+def get_ast(source):
+    return to_ast(parse_source(g, source))
+
+
+def test_compile_incremental_reuses_functions():
+    cache = {}
+    ir_code, compiled = compile_incremental(get_ast(source), cache)
+    assert compiled == ['add', 'twice', 'three', 'main']
+    assert ir_code == str(to_llvm(get_ast(source)))
+
+    ir_code, compiled = compile_incremental(get_ast(source), cache)
+    assert compiled == []
+    assert ir_code == str(to_llvm(get_ast(source)))
+
+    changed = source.replace('return 3;', 'return 4;')
+    ir_code, compiled = compile_incremental(get_ast(changed), cache)
+    assert compiled == ['three']
+    assert ir_code == str(to_llvm(get_ast(changed)))
+
+
+def test_compile_incremental_callee_signature():
+    cache = {}
+    compile_incremental(get_ast(source), cache)
+
+    # `twice` calls `add`, so it depends on its signature. `main` does not.
+    changed = source.replace('int add(int a, int b)', 'int add(int a, char b)')
+    ir_code, compiled = compile_incremental(get_ast(changed), cache)
+    assert compiled == ['add', 'twice']
+    assert ir_code == str(to_llvm(get_ast(changed)))
+
+
+def test_cache_file(tmpdir):
+    path = str(tmpdir.join('cache.json'))
+    assert load_cache(path) == {}
+
+    cache = {}
+    compile_incremental(get_ast(source), cache)
+    save_cache(path, cache)
+    _, compiled = compile_incremental(get_ast(source), load_cache(path))
+    assert compiled == []
+
+
+def test_compile_incremental_strings():
+    with_strings = """int hello() {
+    return puts("hello");
+}
+int main() {
+    puts("hello");
+    return hello();
+}"""
+    cache = {}
+    compile_incremental(get_ast(with_strings), cache)
+
+    # `hello` is reused: the string it shares with `main` is still there, once.
+    changed = with_strings.replace('    puts("hello");', '    puts("bye");')
+    ir_code, compiled = compile_incremental(get_ast(changed), cache)
+    assert compiled == ['main']
+    assert ir_code == str(to_llvm(get_ast(changed)))
+
+
+def test_compile_incremental_loop_metadata():
+    loops = """int count(int n) {
+    int i;
+    int j = 0;
+    for (i = 0; i < n; i = i + 1) j = j + 1;
+    return j;
+}
+int main() {
+    int i;
+    int j = 0;
+    for (i = 0; i < 3; i = i + 1) j = j + count(i);
+    return j;
+}"""
+    cache = {}
+    compile_incremental(get_ast(loops), cache)
+    # Saved numbered from 0, whichever function it belongs to.
+    assert cache['main']['metadata'][-1] == '!2 = distinct !{ !2, !0, !1 }'
+
+    # `count` is compiled again, with a different number of loops: the metadata of `main` moves.
+    changed = loops.replace('return j;\n}\nint main', 'for (i = 0; i < n; i = i + 1) j = j + 1;\n    return j;\n}\n'
+                                                                 'int main')
+    ir_code, compiled = compile_incremental(get_ast(changed), cache)
+    assert compiled == ['count']
+    assert ir_code == str(to_llvm(get_ast(changed)))
+    assert '!8 = distinct !{ !8, !6, !7 }' in ir_code
+
+    # The unroll count is in the metadata of every function.
+    _, compiled = compile_incremental(get_ast(changed), cache, unroll_count=2)
+    assert compiled == ['count', 'main']
+
+
+def test_compile_incremental_inlined():
+    inlined = """int sq(int x) {
+    int y = x;
+    return y * y;
+}
+int a(int n) {
+    return sq(n + 1);
+}
+int b(int n) {
+    return sq(n + 2);
+}
+int main() {
+    return a(1) + b(2);
+}"""
+    cache = {}
+    compile_incremental(Wrap(list(inline_calls(get_ast(inlined).statements))), cache)
+    # The variables of the inlined functions are numbered in each function: `b` is the same as before. `main` is not,
+    # `a` is inlined there.
+    changed = inlined.replace('sq(n + 1)', 'sq(n + 3) + sq(n)')
+    _, compiled = compile_incremental(Wrap(list(inline_calls(get_ast(changed).statements))), cache)
+    assert compiled == ['a', 'main']
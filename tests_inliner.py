@@ -0,0 +1,65 @@
+from lexer import read_grammar, parse_source, to_ast
+from inliner import inline_calls
+from interpreter import run
+from llvm_backend import to_llvm
+from tree import Wrap, FunctionCall
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+
+def inlined(src, limit=20):
+    return Wrap(list(inline_calls(to_ast(parse_source(g, src)).statements, limit)))
+
+
+def calls(function):
+    return [node.function_id.name for node in function.walk() if isinstance(node, FunctionCall)]
+
+
+src = """int square(int x) { return x * x; }
+int shift(int a, char c) { int y = a * 2; y = y + c; return y - 1; }
+int main() {
+    int i;
+    int y = 0;
+    char c = 3;
+    for (i = 0; i < square(3); i = i + 1) {
+        y = y + square(i) + shift(i + 1, c) + square(square(2));
+    }
+    if (shift(y, 300) > square(y)) y = y - 1;
+    return y % 256;
+}"""
+
+
+def test_inline_calls():
+    ast = inlined(src)
+    main = ast.statements[-1]
+    assert calls(main) == []
+    # The functions are still there, for whoever else calls them.
+    assert len(ast.statements) == 3
+    # Renamed, so that `y` in `shift` is not `y` in `main`.
+    declared = [statement.identifier.name for statement in main.body.statements[4:7]]
+    assert declared == ['__inline_shift_5_c', '__inline_shift_5_y', '__inline_shift_5_y']
+    assert run(ast) == run(to_ast(parse_source(g, src)))
+    assert str(to_llvm(ast)).count('call') == 0
+
+
+def test_inline_calls_not_everywhere():
+    src = """int add(int a, int b) { return a + b; }
+int twice(int a) { a = a * 2; return a; }
+int big(int a) { return a + a + a + a + a + a + a + a + a + a + a; }
+int recursive(int a) { if (a) return recursive(a - 1); return 0; }
+int main() {
+    int i;
+    int j = 0;
+    for (i = 0; i < add(i + 1, 2); i = add(i, 1)) j = j + 1;
+    j = add(j, recursive(j));
+    j = (i = 2) + twice(i);
+    return j + big(j);
+}"""
+    main = inlined(src).statements[-1]
+    # In the for: an arg that is not a variable or a constant needs a declaration, there's nowhere to put it.
+    # `recursive(j)` can't run before the statement... and `recursive` is not inlined anyway.
+    # `twice(i)` would need `i` before the assignment.
+    assert calls(main) == ['add', 'add', 'recursive', 'twice', 'big']
+    assert calls(inlined(src, limit=0).statements[-1]) == ['add', 'add', 'add', 'recursive', 'twice', 'big']
+    assert calls(inlined(src, limit=100).statements[-1]) == ['add', 'add', 'recursive', 'twice']
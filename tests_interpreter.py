@@ -0,0 +1,78 @@
+import pytest
+
+from interpreter import run, InterpreterError, wrap_integer
+from lexer import read_grammar, parse_source, to_ast
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+
+def run_source(source):
+    return run(to_ast(parse_source(g, source)))
+
+
+def test_arithmetic():
+    assert run_source('int main() { return 2 + 3 * 4; }') == 14
+    assert run_source('int main() { return 4 / 3 * 2; }') == 2
+    # C division truncates towards zero, Python's rounds down.
+    assert run_source('int main() { return -7 / 2; }') == -3
+    assert run_source('int main() { return -7 % 2; }') == -1
+    assert run_source('int main() { return ~4; }') == -5
+    assert run_source('int main() { return !0 + !3; }') == 1
+    assert run_source('int main() { return (3 > 2) + (3 == 2); }') == 1
+
+
+def test_integer_overflow():
+    assert run_source('int main() { return 2147483647 + 1; }') == -2147483648
+    assert run_source("""int main() {
+    char c = 127;
+    c = c + 1;
+    return c;
+}""") == -128
+    assert wrap_integer(256, 8) == 0
+
+
+def test_control_flow():
+    source = """int main() {
+    int j = 0;
+    int i;
+    for (i = 0; i < 5; i = i + 1) {
+        if (i % 2) j = j + 10; else j = j + 1;
+    }
+    return j;
+}"""
+    assert run_source(source) == 23
+
+    source = """int main() {
+    int i;
+    for (i = 0; i < 100; i = i + 1) {
+        if (i == 7) { return i; }
+    }
+    return 0;
+}"""
+    assert run_source(source) == 7
+
+
+def test_functions():
+    source = """int fibo(int n) {
+    if (n < 2) return n;
+    return fibo(n - 1) + fibo(n - 2);
+}
+int main() {
+    return fibo(10);
+}"""
+    assert run_source(source) == 55
+
+    # Like lli, main gets argc = 1.
+    assert run_source('int main(int argc) { return argc; }') == 1
+
+
+def test_errors():
+    with pytest.raises(InterpreterError):
+        run_source('int main() { return a; }')
+    with pytest.raises(InterpreterError):
+        run_source('int main() { return 1 / 0; }')
+    with pytest.raises(InterpreterError):
+        run_source('int main() { return f(); }')
+    with pytest.raises(InterpreterError, match='Recursion too deep'):
+        run_source('int f(int n) { if (n == 0) return 0; return f(n - 1); }\nint main() { return f(100000); }')
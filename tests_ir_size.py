@@ -0,0 +1,58 @@
+"""Generated code must not grow behind our backs.
+
+The number of instructions of each function of each example is recorded in `examples/ir_sizes.json`. A test fails when
+a function gets bigger. When a change makes functions smaller (or bigger, on purpose), record the new sizes with:
+
+    python tests_ir_size.py
+"""
+import glob
+import json
+import os
+
+import pytest
+
+from lexer import read_grammar, parse_source, to_ast
+from llvm_backend import to_llvm
+from preprocessor import preprocess
+
+SIZES_PATH = os.path.join('examples', 'ir_sizes.json')
+EXAMPLES = sorted(glob.glob(os.path.join('examples', '*', '*.c')))
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+
+def function_sizes(path: str) -> dict:
+    """Function name => number of instructions."""
+    with open(path, 'r') as f:
+        text, source_map = preprocess(f.read())
+    module = to_llvm(to_ast(parse_source(g, text, source_map=source_map)))
+    return {function.name: sum(len(block.instructions) for block in function.blocks)
+            for function in module.functions if function.blocks}
+
+
+def load_sizes() -> dict:
+    try:
+        with open(SIZES_PATH, 'r') as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+
+recorded_sizes = load_sizes()
+
+
+@pytest.mark.parametrize('path', EXAMPLES)
+def test_ir_size(path):
+    recorded = recorded_sizes.get(path)
+    assert recorded is not None, f'No recorded sizes for {path}, run `python tests_ir_size.py`'
+
+    sizes = function_sizes(path)
+    grown = {name: f'{recorded.get(name)} => {size}' for name, size in sizes.items()
+             if name not in recorded or size > recorded[name]}
+    assert not grown, f'More instructions than recorded in {SIZES_PATH}: {grown}'
+
+
+if __name__ == '__main__':
+    with open(SIZES_PATH, 'w') as f:
+        json.dump({path: function_sizes(path) for path in EXAMPLES}, f, indent=2, sort_keys=True)
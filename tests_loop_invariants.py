@@ -0,0 +1,84 @@
+from lexer import read_grammar, parse_source, to_ast
+from interpreter import run
+from llvm_backend import to_llvm
+from loop_invariants import hoist_invariants
+from tree import Declaration, ForLoop, Identifier, Wrap
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+
+def get_ast(src):
+    return to_ast(parse_source(g, src))
+
+
+def hoisted(src):
+    return Wrap(list(hoist_invariants(get_ast(src).statements)))
+
+
+def declarations(block):
+    return {statement.identifier.name: statement for statement in block.statements
+            if isinstance(statement, Declaration) and statement.identifier.name.startswith('__hoisted_')}
+
+
+def test_hoist_invariants():
+    src = """int main() {
+    int n = 5;
+    int a = 3;
+    int b = 4;
+    int total = 0;
+    int i;
+    int j;
+    for (i = 0; i < (n * 2); i = i + 1) {
+        total = total + a * b + i;
+        if (!(a < b)) total = total - 1000;
+        for (j = (n - 3); j < (a + i); j = j + 1) total = total + (i + a) * j + b * 2;
+    }
+    return total % 256;
+}"""
+    ast = hoisted(src)
+    assert run(ast) == run(get_ast(src))
+    main = ast.statements[0]
+    # Condition, body, `if` and inner loop: all the way out.
+    assert sorted(declarations(main.body)) == ['__hoisted_0', '__hoisted_1', '__hoisted_2', '__hoisted_3',
+                                               '__hoisted_4']
+    outer = main.body.statements[-2]
+    assert isinstance(outer, ForLoop)
+    assert isinstance(outer.for_condition.right, Identifier)
+    # `a + i` and `i + a` change with the outer loop, not with the inner one.
+    assert list(declarations(outer.for_body)) == ['__hoisted_5', '__hoisted_6']
+
+
+def test_hoist_invariants_not_everything():
+    src = """int f(int x) { return x; }
+int main() {
+    int a = 3;
+    int b = 0;
+    int i;
+    int total = 0;
+    for (i = 0; i < 3; i = i + 1) {
+        total = total + a / b + f(a * 2) + (a - 1);
+        a = a + 1;
+    }
+    for (i = 0; i < 3; i = i + 1) total = total + (b = 2) * b + (-1);
+    return total;
+}"""
+    ast = hoisted(src)
+    main = ast.statements[-1]
+    # `a` changes in the first loop. In the second: an assignment, and a constant.
+    assert declarations(main.body) == {}
+
+    src = src.replace('        a = a + 1;\n', '')
+    ast = hoisted(src)
+    # No dividing by zero before the loop, no calling functions. Inside the call is fine.
+    main = ast.statements[-1]
+    assert [(node.value.left.name, node.value.operation) for node in declarations(main.body).values()] == \
+        [('a', '*'), ('a', '-')]
+    assert 'sdiv' in str(to_llvm(ast))
+
+
+def test_hoist_invariants_numbered_per_function():
+    loop = 'int {}(int n, int a) {{\n    int i;\n    int t = 0;\n    for (i = 0; i < (n * a); i = i + 1) t = t + i;\n' \
+           '    return t;\n}}'
+    ast = hoisted(loop.format('f') + '\n' + loop.format('g'))
+    assert [list(declarations(function.body)) for function in ast.statements] == [['__hoisted_0'], ['__hoisted_0']]
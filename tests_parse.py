@@ -1,4 +1,8 @@
-from lexer import parse_atom, read_grammar
+import pytest
+
+from lexer import parse_atom, read_grammar, load_grammar, parse_source, SourceSyntaxError, iter_token_lines, \
+    iter_token_records
+from preprocessor import preprocess
 
 with open('C_grammar', 'r') as f:
     g = read_grammar(f.read())
@@ -19,13 +23,28 @@ def test_parse_comment():
     // This is a line comment. Please ignore it.
     return 0;
     }"""
-    tree, remainder = parse_atom(g, 'Wrap', line_comment)
+    tree, remainder = parse_atom(g, 'Wrap', preprocess(line_comment)[0])
     assert not remainder
 
     inline_comment = """int main() {
     return 0; // This is an inline comment. You may also ignore it.
     }"""
-    tree, remainder = parse_atom(g, 'Wrap', inline_comment)
+    tree, remainder = parse_atom(g, 'Wrap', preprocess(inline_comment)[0])
+    assert not remainder
+
+    # This one used to crash: no line break after the comment.
+    trailing_comment = """int main() {
+    return 0;
+    } // Last line."""
+    tree, remainder = parse_atom(g, 'Wrap', preprocess(trailing_comment)[0])
+    assert not remainder.strip()
+
+    block_comment = """int main() {
+    /* This is a block comment.
+       It goes on. */
+    return /* inline */ 0;
+    }"""
+    tree, remainder = parse_atom(g, 'Wrap', preprocess(block_comment)[0])
     assert not remainder
 
 def test_parse_statement():
@@ -55,4 +74,53 @@ def test_parse_for():
 def test_parse_empty_if():
     src = "if (1) { }"
     tree, remainder = parse_atom(g, 'If', src)
-    assert not remainder
\ No newline at end of file
+    assert not remainder
+
+def test_parse_source_error_location():
+    src = """int main() {
+    int a = 3;
+    int b = a +;
+    return b;
+}"""
+    with pytest.raises(SourceSyntaxError) as e:
+        parse_source(g, src)
+    assert (e.value.line, e.value.column) == (3, 16)
+    assert 'Identifier' in e.value.expected
+    assert 'Integer' in e.value.expected
+
+    # Positions are in the original source, comments included.
+    src_with_comments, source_map = preprocess("""// A comment.
+int main() { /* another */ return 1 + ; }""")
+    with pytest.raises(SourceSyntaxError) as e:
+        parse_source(g, src_with_comments, source_map=source_map)
+    assert (e.value.line, e.value.column) == (2, 39)
+
+
+def test_parse_source_step_limit():
+    src = """int main() {
+    if (1) { return 2; } else { return 3; }
+}"""
+    assert parse_source(g, src) == parse_atom(g, 'Wrap', src)[0]
+
+    with pytest.raises(SourceSyntaxError) as e:
+        parse_source(g, src, max_steps=50)
+    assert 'Gave up' in str(e.value)
+
+
+def test_load_grammar(tmpdir):
+    path = tmpdir.join('grammar')
+    path.write('Integer => [1-9][0-9]* | 0\n')
+    assert load_grammar(str(path)) == {'Integer': (['[1-9][0-9]*'], ['0'])}
+    # From the cache this time.
+    assert tmpdir.join('__pycache__', 'grammar.marshal').check()
+    assert load_grammar(str(path)) == {'Integer': (['[1-9][0-9]*'], ['0'])}
+
+    path.write('Integer => [0-9]+\n')
+    assert load_grammar(str(path)) == {'Integer': (['[0-9]+'],)}
+
+
+def test_token_dump():
+    token_list = ['Wrap', ['Block', ['Statement', ['Return', 'return', ['Integer', '1'], ';']]]]
+    assert list(iter_token_lines(token_list)) == ['Wrap', '  Block', '    Statement', '      Return',
+                                                  "        'return'", '        Integer', "          '1'", "        ';'"]
+    assert list(iter_token_records(token_list))[3:5] == [{'depth': 3, 'rule': 'Return'}, {'depth': 4, 'text': 'return'}]
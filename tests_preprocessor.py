@@ -0,0 +1,36 @@
+import pytest
+
+from preprocessor import preprocess, PreprocessError
+
+
+def test_line_comments():
+    text, _ = preprocess('int a = 1; // one\nint b = 2; // two')
+    assert text == 'int a = 1; \nint b = 2; '
+
+
+def test_block_comments():
+    text, _ = preprocess('int/* a\n comment */a = 1;')
+    assert text == 'int a = 1;'
+
+    with pytest.raises(PreprocessError):
+        preprocess('int a = 1; /* never closed')
+
+
+def test_comments_in_literals():
+    src = 'int a = "// not a comment /* either */";'
+    text, _ = preprocess(src)
+    assert text == src
+
+
+def test_source_map():
+    src = """int main() {
+    // Ignore me.
+    /* And me. */ int a = 1;
+    return a;
+}"""
+    text, source_map = preprocess(src)
+    # Offsets in the processed text point back to where the token was written.
+    assert source_map.line_col(text.index('int a')) == (3, 19)
+    assert source_map.line_col(text.index('return')) == (4, 5)
+    assert source_map.line_col(0) == (1, 1)
+    assert src[source_map.original_offset(text.index('a;'))] == 'a'
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+
+from lexer import read_grammar, parse_source, to_ast
+from llvm_backend import iter_llvm, instrumentation_map
+from main import compile
+from profile_report import profile, profile_report
+from tree import Function
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+src = """int f(int a) {
+    if (a < 3) return 1;
+    return 2;
+}
+
+int main() {
+    int i;
+    int total = 0;
+    for (i = 0; i < 5; i = i + 1) total = total + f(i);
+    return total;
+}"""
+
+
+# Calls the libc functions the counts are written with, without a prototype.
+src_with_files = """int main() {
+    int stream = fopen("/dev/null", "w");
+    fprintf(stream, "%d", 1);
+    fclose(stream);
+    return 3;
+}"""
+
+
+def instrumented(path, source=src):
+    ast = to_ast(parse_source(g, source))
+    return ast, ''.join(iter_llvm(ast.statements, instrument=path))
+
+
+def test_instrumentation_map():
+    ast, ir_code = instrumented('counts.txt')
+    counters = instrumentation_map()
+    assert [(counter['function'], counter['block']) for counter in counters] == [
+        ('f', 'entry'), ('f', 'entry.if'), ('f', 'entry.endif'),
+        ('main', 'entry'), ('main', 'entry.forcondition'), ('main', 'entry.forincrement'), ('main', 'entry.for'),
+        ('main', 'entry.endfor')]
+    f_nodes = list(ast.statements[0].walk())
+    assert [f_nodes[counter['node']].__class__.__name__ for counter in counters[:3]] == ['Function', 'If', 'If']
+    assert ir_code.count('add i64') == len(counters)
+    assert '@"llvm.global_dtors"' in ir_code
+
+    # Nothing of the sort without `instrument`.
+    assert 'i64' not in ''.join(iter_llvm(ast.statements))
+    assert instrumentation_map() == []
+
+
+def test_profile():
+    ast, _ = instrumented('counts.txt')
+    functions = {statement.name.name: statement for statement in ast.statements if isinstance(statement, Function)}
+    rows = profile(instrumentation_map(), [5, 3, 2, 1, 6, 5, 5, 1], functions)
+    assert rows[:3] == [(6, 'main', 'entry.forcondition', 'for BinOp(<) Identifier(name=i) Integer(5)'),
+                        (5, 'f', 'entry', 'int f()'),
+                        (5, 'main', 'entry.forincrement', 'for BinOp(<) Identifier(name=i) Integer(5)')]
+    assert rows[-1][:3] == (1, 'main', 'entry.endfor')
+
+
+def test_instrumented_program_calls_libc():
+    _, ir_code = instrumented('counts.txt', src_with_files)
+    # The program's `i32 (...)` declarations, cast for the calls of the dump.
+    assert ir_code.count('declare i32 @"fopen"(...)') == 1
+    assert 'bitcast i32 (...)* @"fopen" to i8* (i8*, i8*)*' in ir_code
+    assert 'bitcast i32 (...)* @"fclose" to i32 (i8*)*' in ir_code
+
+
+@pytest.mark.skipif(shutil.which('lli') is None, reason='needs lli')
+def test_instrumented_program_calls_libc_writes_counts(tmpdir):
+    path = os.path.join(str(tmpdir), 'counts.txt')
+    _, ir_code = instrumented(path, src_with_files)
+    result = subprocess.run(['lli'], input=ir_code.encode())
+    assert result.returncode == 3
+    with open(path, 'r') as f:
+        assert [int(line) for line in f] == [1]
+
+
+@pytest.mark.skipif(shutil.which('lli') is None, reason='needs lli')
+def test_instrumented_program_writes_counts(tmpdir):
+    path = os.path.join(str(tmpdir), 'counts.txt')
+    _, ir_code = instrumented(path)
+    result = subprocess.run(['lli'], input=ir_code.encode())
+    assert result.returncode == 7
+    with open(path, 'r') as f:
+        assert [int(line) for line in f] == [5, 3, 2, 1, 6, 5, 5, 1]
+
+
+def test_profile_report_after_inlining_and_hoisting(tmpdir):
+    source_path = str(tmpdir.join('program.c'))
+    with open(source_path, 'w') as f:
+        # `sq(i + 1)` needs a declaration before the `for`, and `k * 2` is hoisted there: the `for` is not the same
+        # node of the ast any more.
+        f.write(src.replace('int total = 0;', 'int total = sq(i + 1);\n    int k = 2;')
+                .replace('int main', 'int sq(int x) {\n    return x * x;\n}\n\nint main')
+                .replace('f(i);', 'f(i) + (k * 2);'))
+    counts_path = str(tmpdir.join('counts.txt'))
+    result = CliRunner().invoke(compile, ['--instrument', counts_path, source_path])
+    assert result.exit_code == 0, result.output
+    with open(counts_path + '.json', 'r') as f:
+        counters = json.load(f)['counters']
+    with open(counts_path, 'w') as f:
+        f.write('1\n' * len(counters))
+
+    result = CliRunner().invoke(profile_report, [counts_path])
+    assert result.exit_code == 0, result.output
+    rows = [line.split(None, 3) for line in result.output.splitlines()]
+    assert {description for _, _, block, description in rows if block.startswith('entry.for')} == \
+        {'for BinOp(<) Identifier(name=i) Integer(5)'}
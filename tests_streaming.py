@@ -0,0 +1,113 @@
+import io
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from lexer import read_grammar, parse_source, to_ast, SourceSyntaxError
+from llvm_backend import iter_llvm, to_llvm
+from loop_invariants import hoist_invariants
+from main import compile
+from preprocessor import preprocess
+from streaming import iter_statements, iter_statement_tokens, compile_stream
+from tests_incremental import dump
+from tree import Wrap, ast_to_str
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+source = """int add(int a, int b) {
+    return a + b;
+}
+/* A comment
+   that might be cut in two by a chunk. */
+int twice(int a) {
+    return add(a, a);  // So might this one.
+}
+\tint x;
+int main() {
+    int a = 2;
+    return twice(a);
+}"""
+
+
+def full_parse(text):
+    text, source_map = preprocess(text)
+    return to_ast(parse_source(g, text, source_map=source_map))
+
+
+def streamed(text, chunk_size):
+    return Wrap(list(iter_statements(g, io.StringIO(text), chunk_size=chunk_size)))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 30, 10000])
+def test_iter_statements_matches_full_parse(chunk_size):
+    assert dump(streamed(source, chunk_size)) == dump(full_parse(source))
+
+
+def test_iter_statement_tokens():
+    # Each top-level statement of the parse tree, without the `Block` around it and the next ones.
+    statements = list(iter_statement_tokens(g, io.StringIO('int a = 2;\nint f() {\n    return a;\n}'), chunk_size=3))
+    assert [(tokens[0], tokens[1][0]) for tokens in statements] == [('Statement', 'Declaration'),
+                                                                    ('Statement', 'Function')]
+
+
+def test_iter_statements_is_lazy():
+    class Source(io.StringIO):
+        def read(self, size=-1):
+            assert size > 0
+            return super().read(size)
+
+    # The second function is invalid, we still get the first one.
+    statements = iter_statements(g, Source(source.replace('return add(a, a);', 'return add(a a);')), chunk_size=10)
+    assert next(statements).name.name == 'add'
+    with pytest.raises(SourceSyntaxError):
+        next(statements)
+
+
+@pytest.mark.parametrize('chunk_size', [3, 10000])
+def test_iter_statements_error_location(chunk_size):
+    invalid = source.replace('int a = 2;', 'int a = 2 +;')
+    with pytest.raises(SourceSyntaxError) as e:
+        full_parse(invalid)
+    with pytest.raises(SourceSyntaxError) as streamed_e:
+        streamed(invalid, chunk_size)
+    assert str(streamed_e.value) == str(e.value)
+    assert (streamed_e.value.line, streamed_e.value.column) == (11, 16)
+
+
+def test_compile_stream():
+    # No global variables in the backend.
+    functions = source.replace('\tint x;', '')
+    ir_code = ''.join(compile_stream(g, io.StringIO(functions), chunk_size=5))
+    assert ir_code == str(to_llvm(full_parse(functions))) + '\n'
+
+
+def test_compile_stream_loops():
+    loops = """int main() {
+    int i;
+    int j = 0;
+    int n = 3;
+    for (i = 0; i < (n * 2); i = i + 1) j = j + i;
+    return j;
+}"""
+    ir_code = ''.join(compile_stream(g, io.StringIO(loops), hoist=True, unroll_count=4))
+    ast = full_parse(loops)
+    ast.statements = list(hoist_invariants(ast.statements))
+    assert ir_code == ''.join(iter_llvm(ast.statements, unroll_count=4))
+    assert '%"__hoisted_0" = alloca i32' in ir_code
+    assert ir_code.endswith('!2 = distinct !{ !2, !0, !1 }\n')
+
+
+def test_emit_ast_empty_statement(tmpdir):
+    path = str(tmpdir.join('program.c'))
+    with open(path, 'w') as f:
+        f.write('int main() { return 0; }\n;\n')
+    result = CliRunner().invoke(compile, ['--emit', 'ast', path])
+    assert result.exit_code == 0, result.output
+    assert result.output == ast_to_str(to_ast(parse_source(g, 'int main() { return 0; }\n;\n'))) + '\n'
+
+    result = CliRunner().invoke(compile, ['--emit', 'ast', '--json-lines', path])
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [record['node'] for record in records if record['depth'] <= 1] == ['Wrap', 'Function']
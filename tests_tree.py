@@ -1,6 +1,6 @@
 
 
-from tree import Wrap, Function, Return, Integer, Identifier
+from tree import Wrap, Function, Return, Integer, Identifier, BinOp, ast_to_str, iter_ast_lines, iter_ast_records
 
 
 def test_walk():
@@ -16,3 +16,17 @@ def test_walk():
     # We could test for order but the order of function identifier and body is not really well-defined.
     assert len(nodes) == 7
 
+
+
+def test_ast_dump():
+    ast = Wrap([Function('int', Identifier('main'), [Return(BinOp(Integer(1), '+', Integer(2)))])])
+    assert list(iter_ast_lines(ast)) == ast_to_str(ast).split('\n')
+    assert ast_to_str(ast).split('\n')[6:8] == ['          Integer(1)', '          Integer(2)']
+    assert list(iter_ast_records(ast))[3:5] == [{'depth': 2, 'node': 'BodyBlock'}, {'depth': 3, 'node': 'Return'}]
+    assert list(iter_ast_records(ast))[5] == {'depth': 4, 'node': 'BinOp', 'operation': '+'}
+
+    # Deeper than the recursion limit.
+    deep = Integer(0)
+    for _ in range(5000):
+        deep = BinOp(deep, '+', Integer(1))
+    assert sum(1 for _ in iter_ast_lines(deep)) == 10001
@@ -0,0 +1,66 @@
+import pytest
+from click.testing import CliRunner
+
+from lexer import read_grammar, parse_source, to_ast
+from llvm_backend import to_llvm
+from main import compile
+from tree import BinOp, Identifier, UnOp, Assignment, FunctionCall
+from type_inference import function_types, TypeInferenceError, BOOL, CHAR, INT
+
+with open('C_grammar', 'r') as f:
+    g = read_grammar(f.read())
+
+
+def first_function(source):
+    return to_ast(parse_source(g, source)).statements[0]
+
+
+def test_function_types():
+    function = first_function("""int f(char c) {
+    int a = c + 1;
+    char b = a;
+    b = 'x';
+    if (!(a < b)) return f(b);
+    return a;
+}""")
+    types = function_types(function, {'f': INT})
+    nodes = list(function.body.walk())
+
+    def type_of(cls):
+        return [types[id(node)] for node in nodes if isinstance(node, cls)]
+
+    assert type_of(BinOp) == [INT, BOOL]
+    assert type_of(UnOp) == [BOOL]
+    # The value of an assignment has the type of the variable.
+    assert type_of(Assignment) == [CHAR]
+    assert type_of(FunctionCall) == [INT]
+    assert [types[id(n)] for n in nodes if isinstance(n, Identifier) and id(n) in types] == \
+        [CHAR, INT, CHAR, INT, CHAR, CHAR, INT]
+
+
+def test_function_types_unknown_variable():
+    with pytest.raises(TypeInferenceError):
+        function_types(first_function('int f() { return a; }'), {'f': INT})
+
+
+def test_narrow_integers_to_llvm():
+    ir_code = str(to_llvm(to_ast(parse_source(g, """char f(char c, int i) {
+    if (c < i) return c;
+    return c < i;
+}"""))))
+    assert 'define i8 @"f"(i8 %".1", i32 %".2")' in ir_code
+    # Promoted for the comparison...
+    assert ir_code.count('sext i8') == 2
+    # ... which is used as is in the condition, and only extended when returned.
+    assert ir_code.count('zext i1') == 1
+    assert ir_code.count('icmp') == 2
+
+
+def test_type_error_in_main(tmpdir):
+    path = str(tmpdir.join('program.c'))
+    with open(path, 'w') as f:
+        f.write('int main() { return "a" * 2; }\n')
+    for options in [[], ['--cache-dir', str(tmpdir.join('cache'))]]:
+        result = CliRunner().invoke(compile, options + [path])
+        assert result.exit_code == 1
+        assert f'Error: {path}: Cannot use a string as a int' in result.output
@@ -1,6 +1,6 @@
 """Note our method to go from parsing output to AST expects to find a class in this file for each grammar expression."""
 
-from typing import Union, List
+from typing import Iterator, List, Tuple, Union
 
 
 class AstNode:
@@ -8,7 +8,7 @@ class AstNode:
     # Ex: in 'var a = 2', we don't need 'var' when building our Assignment node.
     SYNTAX_STRINGS = {'=', ';', ',', '', '"', "'", '(', ')', '()', '{', '}', '{}', 'return', 'if', 'else', 'for',
                       # I'm not sure anymore why I need whitespace characters here. Removing does break tests though ;).
-                      ' ', '\n'}
+                      ' ', '\n', '\t', '\r'}
 
     @property
     def children(self):
@@ -22,7 +22,9 @@ class AstNode:
         """Traverse the ast depth-first and yield the nodes."""
         yield self
         for child in self.children:
-            yield from child.walk()
+            # Optional parts of a node (like the args of `f()`) are None.
+            if child is not None:
+                yield from child.walk()
 
 
 class Wrap(AstNode):
@@ -68,7 +70,8 @@ class Integer(Expr):
 
 class String(Expr):
 
-    def __init__(self, value: str):
+    # An empty string is an empty string token, and those are dropped (see SYNTAX_STRINGS).
+    def __init__(self, value: str = ''):
         self.value = value
 
     def __str__(self):
@@ -295,8 +298,32 @@ Expr2 = Expr
 
 def ast_to_str(ast: AstNode, depth=0):
     """Return a pretty-print representation of an AST"""
+    return '\n'.join(iter_ast_lines(ast, depth))
+
+
+def iter_depth_first(ast: AstNode, depth=0) -> Iterator[Tuple[int, AstNode]]:
+    """(depth, node) for `ast` and everything below it, in the order of `walk`. No recursion: deep trees are fine.
+
+    Nothing for None (an empty statement), like `ast_to_str` skips it."""
+    stack = [(depth, ast)] if ast is not None else []
+    while stack:
+        depth, node = stack.pop()
+        yield depth, node
+        stack.extend((depth + 1, child) for child in reversed(node.children) if child is not None)
+
+
+def iter_ast_lines(ast: AstNode, depth=0) -> Iterator[str]:
+    """The lines of `ast_to_str`, one at a time, for when the whole text would be too big."""
     indent = ' ' * 2
     # Each node class is responsible for providing a __str__ function.
-    extra_break = '\n' if ast.children else ''
-    return indent * depth + str(ast) + extra_break + '\n'.join(
-        [ast_to_str(child, depth=depth + 1) for child in ast.children])
+    for node_depth, node in iter_depth_first(ast, depth):
+        yield indent * node_depth + str(node)
+
+
+def iter_ast_records(ast: AstNode, depth=0) -> Iterator[dict]:
+    """One dict per node, in the order of `iter_ast_lines`: its depth, its class and its values (the name of an
+    Identifier, the operation of a BinOp...). The depth is enough to rebuild the tree. Made for JSON Lines."""
+    for node_depth, node in iter_depth_first(ast, depth):
+        record = {'depth': node_depth, 'node': node.__class__.__name__}
+        record.update((key, value) for key, value in vars(node).items() if isinstance(value, (str, int)))
+        yield record
@@ -0,0 +1,101 @@
+"""Work out the C type of every expression of a function, before generating its IR.
+
+The backend uses it to pick integer widths: `int` is an i32, `char` an i8. Comparisons and `!` are 'bool', an i1: C says
+they are ints, but as long as they are only used as conditions (`if (a < b)`, `!(a < b)`) there's no reason to widen
+them. They are only extended when they escape, like in `return a < b;`.
+
+Conversions follow C: operands of arithmetic operators and comparisons are promoted to int (`char + char` is an int),
+and values are converted to the type of where they go (variables, arguments, return values).
+"""
+from typing import Dict, List, Union
+
+from tree import AstNode, Assignment, BinOp, Char, Declaration, Function, FunctionCall, Identifier, Integer, String, \
+    UnOp
+
+INT = 'int'
+CHAR = 'char'
+BOOL = 'bool'
+# `char *`. Only string literals have that type, we have no pointer variables.
+STRING = 'string'
+
+ARITHMETIC_OPERATIONS = {BinOp.ADD, BinOp.SUBSTRACT, BinOp.MULTIPLY, BinOp.DIVIDE, BinOp.MODULO}
+
+
+class TypeInferenceError(Exception):
+    pass
+
+
+def function_types(node: Function, return_types: Dict[str, str]) -> Dict[int, str]:
+    """The type of each expression in the function, by `id` of the node.
+
+    :param return_types: function name => return type, for the functions it calls. The others return an int.
+    """
+    variables = {arg.identifier.name: arg.type for arg in node.args.args}
+    types = {}
+    infer_types(node.body, variables, return_types, types)
+    return types
+
+
+class RewriteTypes(dict):
+    """`function_types`, for a pass that rewrites the function. It's by node id: it also keeps the nodes of the
+    function, so that the new nodes of the pass can't get the ids of the ones they replace."""
+
+    def __init__(self, types: Dict[int, str], nodes: List[AstNode]):
+        super().__init__(types)
+        self.nodes = nodes
+
+
+def rewrite_types(node: Function, return_types: Dict[str, str]) -> Union[RewriteTypes, None]:
+    """See `RewriteTypes`. None if the types don't work out: then the backend will complain, not the pass."""
+    try:
+        return RewriteTypes(function_types(node, return_types), list(node.walk()))
+    except TypeInferenceError:
+        return None
+
+
+def infer_types(node: AstNode, variables: Dict[str, str], return_types: Dict[str, str], types: Dict[int, str]):
+    """Fill `types` for `node` and everything below it. Return the type of `node`, None if it's not an expression.
+
+    Like the backend, there is one scope per function: `variables` is variable name => type.
+    """
+    if isinstance(node, Declaration):
+        if node.value is not None:
+            infer_types(node.value, variables, return_types, types)
+        variables[node.identifier.name] = node.type
+        return None
+
+    if isinstance(node, (Integer, Char)):
+        # 'a' is an int in C, not a char.
+        node_type = INT
+    elif isinstance(node, String):
+        node_type = STRING
+    elif isinstance(node, Identifier):
+        try:
+            node_type = variables[node.name]
+        except KeyError:
+            raise TypeInferenceError(f'Unknown variable {node.name}') from None
+    elif isinstance(node, Assignment):
+        infer_types(node.value, variables, return_types, types)
+        # The value of `a = b` is the new value of `a`.
+        node_type = infer_types(node.identifier, variables, return_types, types)
+    elif isinstance(node, BinOp):
+        infer_types(node.left, variables, return_types, types)
+        infer_types(node.right, variables, return_types, types)
+        node_type = INT if node.operation in ARITHMETIC_OPERATIONS else BOOL
+    elif isinstance(node, UnOp):
+        infer_types(node.operand, variables, return_types, types)
+        node_type = BOOL if node.operation == UnOp.NOT else INT
+    elif isinstance(node, FunctionCall):
+        if node.args is not None:
+            infer_types(node.args, variables, return_types, types)
+        # A function we know nothing about returns an int, C89 says so.
+        node_type = return_types.get(node.function_id.name, INT)
+    else:
+        # Statements, blocks... Just what's below them.
+        for child in node.children:
+            if child is not None:
+                infer_types(child, variables, return_types, types)
+        return None
+
+    types[id(node)] = node_type
+    return node_type